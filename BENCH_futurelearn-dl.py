@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import sys, os
+import json
+import re
+import tracemalloc
+from time import perf_counter
+
+'''
+    Offline benchmark and regression check of the futurelearn_dl page parsers.
+
+    Feeds the course todo, week and step pages found in a fixture directory through
+    parseCoursePage, parseCourseWeekPage and getDownloadableURLs, checking the results
+    against <dir>/expected.json (if present) and reporting pages/sec and the peak
+    memory allocated per page.
+    Step pages are also parsed by the previous step parser, which scanned the page once
+    per download type (see baselineDownloadableURLs), for comparison.
+    Synthetic step pages of increasing size then show how the step parsers scale.
+
+    Pages saved by futurelearn-dl.py into TMP_DIR/FUTURELEARN_DL (course.<id>.response.content,
+    course.<id>.w<week>.response.content, course.<id>.s<step>.response.content) can be
+    benchmarked too.
+
+    Usage:
+        BENCH_futurelearn-dl.py [<fixture_dir>] [<iterations>]
+'''
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, HERE)
+import futurelearn_dl as fl
+
+DOWNLOAD_TYPES = [ 'pdf', 'mp4', 'vtt' ]
+
+def getParser(file):
+    ''' RETURNS: name and function parsing the page in file, chosen from its name '''
+    name = os.path.basename(file)
+    if name.startswith('step.') or re.search(r'\.s\d+\.response\.content$', name):
+        return 'step', lambda content: fl.getDownloadableURLs(content, DOWNLOAD_TYPES)
+    if name.startswith('course.week') or re.search(r'\.w\d+\.response\.content$', name):
+        return 'week', fl.parseCourseWeekPage
+    return 'course', fl.parseCoursePage
+
+def baselineDownloadableURLs(content, download_types):
+    '''
+       The step parser getDownloadableURLs replaced, kept as the baseline of the benchmark:
+       one scan of the page per download type, lowering a copy of the page for each match.
+       Kept as it was but for raising instead of exiting (its results aren't checked:
+       it took the HD flag from neighbouring tags, and stopped at a non english track)
+
+       RETURNS: the urls of download_types found in content
+    '''
+    urls = []
+    for DOWNLOAD_TYPE in download_types:
+        urls += baselineTypeURLs(content, DOWNLOAD_TYPE)
+    return urls
+
+def baselineTypeURLs(content, DOWNLOAD_TYPE):
+    urls = []
+    urls_seen = []
+
+    POS_MATCH='<a href='
+    MEDIA_MATCH=DOWNLOAD_TYPE
+
+    # except for video
+    if DOWNLOAD_TYPE == 'mp4':
+        POS_MATCH='<video'
+        MEDIA_MATCH='video/mp4'
+    elif DOWNLOAD_TYPE == 'vtt':
+        POS_MATCH = '<div class="track" data-src='
+
+    # If there's no mention of such media in the whole file, leave now:
+    if not MEDIA_MATCH in content.lower():
+        return urls
+
+    pos = content.lower().find(DOWNLOAD_TYPE)
+    fl.debug(2, "Searching for {} in <<{}...>>".format(DOWNLOAD_TYPE, content[pos-20:pos+20]))
+
+    pos = 0
+
+    while POS_MATCH in content.lower():
+
+        if DOWNLOAD_TYPE == 'vtt':
+            SRCLANG = 'data-srclang='
+            langpos = content[pos:].lower().find(SRCLANG)
+            if langpos != -1:
+                if content[langpos+len(SRCLANG)+1:langpos+len(SRCLANG)+3].lower() != 'en':
+                    break
+
+        mpos = content[pos:].lower().find(POS_MATCH)
+        if mpos == -1:
+            return urls
+
+        fl.debug(4, "FOUND {} at mpos={}".format(DOWNLOAD_TYPE, str(mpos)))
+        pos += mpos
+
+        # In video case, we also need to advance to the '<source src="XX"' tag
+        if DOWNLOAD_TYPE == 'mp4':
+            fl.debug(4, "video in <<{}...>>".format(content[pos:pos+400]))
+            pos += len(POS_MATCH)
+
+            SRC_MATCH='<source src='
+            mpos = content[pos:].lower().find(SRC_MATCH)
+            if content[pos-150:].lower().find('data-hd-src=') > 0:
+                isHD = True
+            else:
+                isHD = False
+
+            # If there's no match, assume we reached the end of the content:
+            if mpos == -1:
+                return urls
+
+            pos += mpos
+            pos += len(SRC_MATCH)
+            fl.debug(4, "source src ==> <<{}...>>".format(content[pos:pos+400]))
+        else:
+            fl.debug(4, "HREF ==> <<{}...>>".format(content[pos:pos+400]))
+            pos += len(POS_MATCH)
+
+        content = content.replace('\\"', '"')
+        quote = content[pos]
+        if quote != "'" and quote != '"':
+            raise ValueError("No quote(char={}) in <<{}...>>".format(quote, content[pos-10:pos+10]))
+
+        # step over start-quote:
+        pos += 1
+
+        # detect end-quote:
+        eqpos = content[pos:].find(quote)
+        if eqpos == -1:
+            raise ValueError("No end-quote in <<{}...>>".format(content[pos:pos+100]))
+        eqpos += pos
+
+        # Strip out the url, between the quotes:
+        url=content[pos:eqpos]
+
+        # Detect if just "//url" and insert http:
+        if url[0:2] == "//":
+            url = "https:" + url
+
+        fl.debug(2, "content[{}:{}] => url={}".format(pos, eqpos, url))
+
+        urls_seen.append(url)
+        lurl = url.lower()
+
+        if DOWNLOAD_TYPE == 'mp4':
+            url = url[:-5] + 'download'
+
+            if isHD:
+                url = url + '/hd'
+            urls.append( url )
+        else:
+            # With other types, check that the url ends with the type e.g. ".pdf"
+            if lurl[-(1+len(DOWNLOAD_TYPE)):] == "." + DOWNLOAD_TYPE:
+                urls.append( url )
+            elif lurl[-(1 + len(DOWNLOAD_TYPE) + 15):-15] == "." + DOWNLOAD_TYPE:
+                url = url[:-15]
+                urls.append(url)
+
+    return urls
+
+def baselineRate(kind, content, iterations):
+    ''' RETURNS: the pages/sec of the baseline parser of kind pages (only step pages have one), or None '''
+    if kind != 'step':
+        return None
+    return bench(lambda content: baselineDownloadableURLs(content, DOWNLOAD_TYPES), content, iterations)[0]
+
+def formatBaseline(rate, baseline_rate):
+    ''' RETURNS: the baseline pages/sec and the speedup over it, as columns '''
+    if baseline_rate is None:
+        return "{:>12} {:>8}".format('-', '-')
+    return "{:>12.1f} {:>7.1f}x".format(baseline_rate, rate / baseline_rate)
+
+def bench(parse, content, iterations):
+    '''
+       Run parse(content) iterations times
+
+       RETURNS: pages/sec, peak bytes allocated by one parse
+    '''
+    tracemalloc.start()
+    parse(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    start = perf_counter()
+    for i in range(iterations):
+        parse(content)
+    elapsed = perf_counter() - start
+
+    return iterations / elapsed, peak
+
+def syntheticStepPage(num_blocks):
+    ''' RETURNS: a step page of num_blocks paragraphs with videos, tracks and pdf links '''
+    parts = [ '<html><body><article class="m-step">' ]
+    for i in range(num_blocks):
+        parts.append('<p>Paragraph {} of the step article, with some <b>formatted</b> text.</p>'.format(i))
+        if i % 10 == 0:
+            parts.append('<video poster="//view.vzaar.com/{0}/image" id="video-{0}" data-hd-src="//view.vzaar.com/{0}/video/hd" data-sd-src="//view.vzaar.com/{0}/video">'
+                         '<source src="//view.vzaar.com/{0}/video" type="video/mp4" /></video>'.format(i))
+            parts.append('<div class="track" data-src="https://ugc.futurelearn.com/captions/{}.vtt" data-srclang="en"></div>'.format(i))
+        if i % 7 == 0:
+            parts.append('<a href="https://ugc.futurelearn.com/uploads/files/handout{}.pdf">handout</a>'.format(i))
+    parts.append('</article></body></html>')
+    return ''.join(parts)
+
+def main():
+    fixture_dir = sys.argv[1] if len(sys.argv) > 1 else HERE + '/fixtures'
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    expected = {}
+    if os.path.exists(fixture_dir + '/expected.json'):
+        with open(fixture_dir + '/expected.json', 'r') as f:
+            expected = json.load(f)
+
+    failures = 0
+    print("{:<40} {:>6} {:>9} {:>12} {:>10} {:>12} {:>8}".format('page', 'parser', 'bytes', 'pages/sec', 'peak KB',
+                                                               'baseline', 'speedup'))
+    for name in sorted(os.listdir(fixture_dir)):
+        if name == 'expected.json':
+            continue
+        file = fixture_dir + '/' + name
+        with open(file, 'r', encoding='utf8', errors='ignore') as f:
+            content = f.read()
+
+        kind, parse = getParser(file)
+        if name in expected and parse(content) != expected[name]:
+            print("FAIL: {} parsed as {}, expected {}".format(name, parse(content), expected[name]))
+            failures += 1
+
+        rate, peak = bench(parse, content, iterations)
+        print("{:<40} {:>6} {:>9} {:>12.0f} {:>10.1f} {}".format(name[:40], kind, len(content), rate, peak / 1024,
+                                                               formatBaseline(rate, baselineRate(kind, content, iterations))))
+
+    print()
+    print("Synthetic step pages:")
+    print("{:<40} {:>6} {:>9} {:>12} {:>10} {:>12} {:>8}".format('blocks', 'parser', 'bytes', 'pages/sec', 'peak KB',
+                                                               'baseline', 'speedup'))
+    for num_blocks in (100, 1000, 10000):
+        content = syntheticStepPage(num_blocks)
+        kind, parse = getParser('step.synthetic')
+        num_iterations = max(1, iterations * 100 // num_blocks)
+        rate, peak = bench(parse, content, num_iterations)
+        print("{:<40} {:>6} {:>9} {:>12.1f} {:>10.1f} {}".format(num_blocks, kind, len(content), rate, peak / 1024,
+                                                               formatBaseline(rate, baselineRate(kind, content, num_iterations))))
+
+    if failures:
+        print("{} regression(s)".format(failures))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
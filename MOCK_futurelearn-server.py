@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import random
+import re
+import threading
+from time import sleep, time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+'''
+    Local stand-in for futurelearn.com and view.vzaar.com, to exercise futurelearn-dl.py
+    end to end without a real account:
+
+    - /sign-in                         sign-in page with an authenticity_token, POST to login
+    - /courses/<id>/<run>/todo         course todo page linking the weeks
+    - /courses/<id>/<run>/todo/<week>  week page linking the steps
+    - /courses/<id>/<run>/steps/<step> step page with a <video>, subtitle tracks and a pdf link
+    - /vzaar/<video>/download[/hd]     synthetic mp4 (the hd one is twice the size)
+    - /files/<name>.pdf                synthetic pdf (other extensions: synthetic png, docx ...)
+    - /captions/<video>-<lang>.vtt     WebVTT subtitles
+
+    Files support Range requests, ETag/Last-Modified and conditional GETs.
+    Latency, throttling, 5xx errors (with Retry-After) and dropped connections can be injected.
+
+    Usage:
+        MOCK_futurelearn-server.py [--port 8765] [--latency 0.05] [--rate 1000000] [--error-rate 0.1] ...
+
+        FL_BASE_URL=http://127.0.0.1:8765 ./futurelearn-dl.py user password mock-course 1
+'''
+
+TOKEN = 'x' * 88
+SESSION_COOKIE = 'mock_session'
+START_TIME = formatdate(time(), usegmt=True)
+CHUNK_SIZE = 64 * 1024
+
+stats = { 'requests': 0, 'bytes': 0, 'errors': 0, 'drops': 0 }
+stats_lock = threading.Lock()
+
+def count(key, n=1):
+    with stats_lock:
+        stats[key] += n
+
+def weekIds(options):
+    return [ 1000 + week for week in range(1, options.weeks + 1) ]
+
+def stepIds(options, week_id):
+    return [ week_id * 100 + step for step in range(1, options.steps + 1) ]
+
+def videoId(step_id):
+    return 2000000 + step_id
+
+def mp4Content(video_id, size):
+    ''' RETURNS: generator of the chunks of a synthetic mp4 of size bytes '''
+    header = b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom'
+    block = hashlib.sha256(str(video_id).encode('utf8')).digest() * (CHUNK_SIZE // 32)
+    yield header[:size]
+    sent = len(header[:size])
+    while sent < size:
+        chunk = block[:size - sent]
+        yield chunk
+        sent += len(chunk)
+
+def pdfContent(name, size):
+    body = b'%PDF-1.4\n% ' + name.encode('utf8') + b'\n'
+    return body + b'0' * max(0, size - len(body) - 6) + b'\n%%EOF'
+
+def fileContent(name, extension, size):
+    magic = { 'png': b'\x89PNG\r\n\x1a\n', 'docx': b'PK\x03\x04', 'zip': b'PK\x03\x04', 'mp3': b'ID3' }
+    body = magic.get(extension, b'') + name.encode('utf8') + b'\n'
+    return body + b'0' * max(0, size - len(body))
+
+def vttContent(video_id, lang):
+    lines = [ 'WEBVTT', '' ]
+    for i in range(10):
+        lines.append('00:00:{:02d}.000 --> 00:00:{:02d}.500'.format(i * 5, i * 5 + 4))
+        lines.append('[{}] caption {} of video {}'.format(lang, i + 1, video_id))
+        lines.append('')
+    return '\n'.join(lines).encode('utf8')
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.options.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def sendPage(self, html, status=200, headers={}):
+        body = html.encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name in headers:
+            self.send_header(name, headers[name])
+        self.end_headers()
+        self.wfile.write(body)
+        count('bytes', len(body))
+
+    def sendError(self, status, headers={}):
+        count('errors')
+        self.sendPage('<html><body><h1>Error {}</h1></body></html>'.format(status), status, headers)
+
+    def injectFaults(self):
+        ''' Apply latency and random 5xx errors. RETURNS: True if an error was sent '''
+        options = self.server.options
+        if options.latency:
+            sleep(options.latency)
+        if options.error_rate and random.random() < options.error_rate:
+            self.sendError(random.choice([ 500, 502, 503 ]), { 'Retry-After': '1' })
+            return True
+        return False
+
+    def isLoggedIn(self):
+        return SESSION_COOKIE + '=' in self.headers.get('Cookie', '')
+
+    def do_POST(self):
+        count('requests')
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if self.path != '/sign-in':
+            return self.sendError(404)
+
+        self.sendPage('<html><body>Signed in</body></html>', 200,
+                      { 'Set-Cookie': '{}={}; Path=/; HttpOnly'.format(SESSION_COOKIE, random.getrandbits(64)) })
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        count('requests')
+        options = self.server.options
+        if self.injectFaults():
+            return
+
+        path = self.path.split('?')[0]
+        if path == '/sign-in':
+            return self.sendPage('<html><body><form action="/sign-in" method="post">'
+                                 '<input type="hidden" name="authenticity_token" value="{}" />'
+                                 '</form></body></html>'.format(TOKEN))
+
+        match = re.match(r'/courses/([^/]+)/(\d+)/(todo|steps)(?:/(\d+))?$', path)
+        if match:
+            if not self.isLoggedIn():
+                return self.sendError(403)
+            course_id, course_run, kind, item = match.groups()
+            base = '/courses/{}/{}'.format(course_id, course_run)
+            if kind == 'todo' and item is None:
+                links = ''.join([ '<li><a href="{}/todo/{}"><div>Week {}</div></a></li>\n'.format(base, week_id, week_id - 1000)
+                                  for week_id in weekIds(options) ])
+                return self.sendCachedPage('<html><body><ul>\n' + links + '</ul></body></html>')
+            if kind == 'todo':
+                links = ''.join([ '<li><a href="{}/steps/{}"><span>{}</span></a></li>\n'.format(base, step_id, step_id)
+                                  for step_id in stepIds(options, int(item)) ])
+                return self.sendCachedPage('<html><body><ol>\n' + links + '</ol></body></html>')
+            return self.sendCachedPage(self.stepPage(int(item)))
+
+        match = re.match(r'/vzaar/(\d+)/download(/hd)?$', path)
+        if match:
+            size = options.video_size * (2 if match.group(2) else 1)
+            return self.sendFile(path, size, 'video/mp4', lambda: mp4Content(int(match.group(1)), size), head)
+
+        match = re.match(r'/files/(.+\.pdf)$', path)
+        if match:
+            content = pdfContent(match.group(1), options.pdf_size)
+            return self.sendFile(path, len(content), 'application/pdf', lambda: [ content ], head)
+
+        match = re.match(r'/files/(.+)\.(\w+)$', path)
+        if match:
+            content = fileContent(match.group(1), match.group(2), options.pdf_size)
+            return self.sendFile(path, len(content), 'application/octet-stream', lambda: [ content ], head)
+
+        match = re.match(r'/captions/(\d+)-(\w+)\.vtt$', path)
+        if match:
+            content = vttContent(int(match.group(1)), match.group(2))
+            return self.sendFile(path, len(content), 'text/vtt', lambda: [ content ], head)
+
+        self.sendError(404)
+
+    def stepPage(self, step_id):
+        video_id = videoId(step_id)
+        host = '//{}:{}'.format(*self.server.server_address[:2])
+        tracks = ''.join([ '<div class="track" data-src="{}/captions/{}-{}.vtt" data-srclang="{}"></div>\n'.format(host, video_id, lang, lang)
+                           for lang in self.server.options.languages.split(',') ])
+        return ('<html><body><article class="m-step">\n'
+                '<h1>Step {0}</h1>\n'
+                '<video poster="{1}/vzaar/{2}/image" id="video-{2}" class="video-js" data-hd-src="{1}/vzaar/{2}/video/hd" data-sd-src="{1}/vzaar/{2}/video">'
+                '<source src="{1}/vzaar/{2}/video" type="video/mp4" /></video>\n'
+                '{3}'
+                '<p>Article text of step {0}.</p>\n'
+                '<a href="{1}/files/step{0}.pdf">Handout</a>\n'
+                '<a href="{1}/files/notes{0}.docx">Notes</a>\n'
+                '<img alt="Figure" src="{1}/files/figure{0}.png" />\n'
+                '<iframe width="560" src="https://www.youtube.com/embed/{4}"></iframe>\n'
+                '</article></body></html>\n').format(step_id, host, video_id, tracks, ('yt' + str(step_id) * 2)[:11])
+
+    def sendCachedPage(self, html):
+        etag = '"' + hashlib.sha1(html.encode('utf8')).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.sendPage(html, 200, { 'ETag': etag, 'Last-Modified': START_TIME })
+
+    def sendFile(self, path, size, content_type, content, head):
+        ''' Send content(), honouring Range/If-Range/If-None-Match, with throttling and drops '''
+        options = self.server.options
+        etag = '"' + hashlib.sha1('{}:{}'.format(path, size).encode('utf8')).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        start = 0
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if match and self.headers.get('If-Range', etag) == etag:
+            start = int(match.group(1))
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, size - 1, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(size - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', START_TIME)
+        self.end_headers()
+        if head:
+            return
+
+        drop_at = size
+        if options.drop_rate and random.random() < options.drop_rate:
+            drop_at = random.randint(start, size - 1)
+
+        pos = 0
+        for chunk in content():
+            if pos + len(chunk) <= start:
+                pos += len(chunk)
+                continue
+            chunk = chunk[max(0, start - pos):]
+            pos = max(pos, start)
+            if pos + len(chunk) > drop_at:
+                self.wfile.write(chunk[:drop_at - pos])
+                count('drops')
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            self.wfile.write(chunk)
+            count('bytes', len(chunk))
+            pos += len(chunk)
+            if options.rate:
+                sleep(len(chunk) / options.rate)
+
+def main():
+    parser = argparse.ArgumentParser(description='Local mock of futurelearn.com and view.vzaar.com')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--weeks', type=int, default=3, help='weeks per course')
+    parser.add_argument('--steps', type=int, default=4, help='steps per week')
+    parser.add_argument('--video-size', type=int, default=4 * 1024 * 1024, help='bytes per SD video')
+    parser.add_argument('--pdf-size', type=int, default=64 * 1024, help='bytes per pdf')
+    parser.add_argument('--languages', default='en,es', help='subtitle languages of each video')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to each response')
+    parser.add_argument('--rate', type=int, default=0, help='bytes/sec limit of each file transfer')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests failing with 5xx')
+    parser.add_argument('--drop-rate', type=float, default=0, help='fraction of file transfers dropped midway')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true')
+    options = parser.parse_args()
+
+    random.seed(options.seed)
+    server = ThreadingHTTPServer((options.host, options.port), MockHandler)
+    server.options = options
+    print("Mock FutureLearn on http://{}:{}".format(options.host, options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print("Served {requests} requests, {bytes} bytes, {errors} errors, {drops} dropped transfers".format(**stats))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3336 @@
+#!/usr/bin/env python3
+
+import sys, os, errno
+import requests
+import json
+import re
+import shutil
+import hashlib
+import html
+import codecs
+import zlib
+import sqlite3
+import argparse
+import threading
+import queue
+import random
+import itertools
+import socket
+import multiprocessing
+import http.cookiejar
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+from time import sleep, monotonic, time
+from urllib.parse import urlparse, unquote
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timedelta
+
+'''
+    Author: Michael Bright, @mjbright
+    Created: 2015-Oct-24
+
+    Attempt at auto-downloading videos and other materials from futurelearn.com
+
+    The downloader can also be used as a module: importing it does nothing, a
+    FutureLearnClient holds the login session, page cache and download workers shared
+    by any number of CourseDownloader, one per course run:
+
+        import futurelearn_dl
+
+        client = futurelearn_dl.FutureLearnClient(op_dir='courses')
+        course = client.course('data-to-insight', 1)
+        client.login(email, password, check_url=course.course_url)
+
+        for week_num, week_id in course.iter_weeks():
+            ...
+        for entry in course.iter_assets():
+            print(entry['type'], entry['url'], entry['file'])
+'''
+
+# Override to run against another server, e.g. MOCK_futurelearn-server.py:
+BASE_URL   = os.getenv('FL_BASE_URL', default='https://www.futurelearn.com')
+
+PAUSE   = os.getenv('FL_PAUSE', default=False)
+DEBUG   = os.getenv('FL_DEBUG', default=False)
+VERBOSE = int(os.getenv('FL_VERBOSE', default=1))
+
+DOWNLOAD=True
+OVERWRITE_NONEMPTY_FILES=False
+
+# Downloads are streamed to disk in chunks of this size:
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Interrupted downloads are resumed up to this many times, stalled ones time out after
+# DOWNLOAD_TIMEOUT seconds:
+DOWNLOAD_RETRIES = int(os.getenv('FL_RETRIES', default=5))
+DOWNLOAD_TIMEOUT = int(os.getenv('FL_TIMEOUT', default=60))
+
+# Only this many leading bytes of a download are checked for an error document:
+SNIFF_SIZE = 4096
+SIGNATURE_ERROR = "The request signature we calculated"
+
+# Number of download worker threads draining the download queue:
+WORKERS = int(os.getenv('FL_WORKERS', default=4))
+
+# Requests failing with a network error or one of RETRYABLE_STATUS are retried up to
+# HTTP_RETRIES times, waiting BACKOFF * 2^attempt seconds (+/-50% jitter, at most BACKOFF_MAX)
+# or as long as the server asks with Retry-After
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+HTTP_RETRIES = int(os.getenv('FL_HTTP_RETRIES', default=5))
+BACKOFF      = float(os.getenv('FL_BACKOFF', default=1))
+BACKOFF_MAX  = 120
+
+# Live progress line, printed every PROGRESS_INTERVAL seconds (default: when stderr is a terminal)
+PROGRESS = os.getenv('FL_PROGRESS', default='1' if sys.stderr.isatty() else '0') != '0'
+PROGRESS_INTERVAL = float(os.getenv('FL_PROGRESS_INTERVAL', default=2))
+
+# Per-host politeness: requests/second allowed to each host, and the burst size, shared
+# by the --processes of this host (but not with the --worker processes of other hosts)
+HOST_RATE  = float(os.getenv('FL_HOST_RATE', default=0.2))
+HOST_BURST = int(os.getenv('FL_HOST_BURST', default=2))
+
+# Number of threads fetching week and step pages during the crawl phase:
+CRAWL_WORKERS = int(os.getenv('FL_CRAWL_WORKERS', default=8))
+
+# On-disk cache of course/week/step pages: pages younger than CACHE_TTL seconds are
+# not re-fetched, older ones are revalidated with a conditional request.
+# The cache is trimmed to CACHE_SIZE bytes, least recently used pages first.
+PAGE_CACHE = os.getenv('FL_CACHE', default='1') != '0'
+CACHE_TTL  = int(os.getenv('FL_CACHE_TTL', default=3600))
+CACHE_SIZE = int(os.getenv('FL_CACHE_SIZE', default=200 * 1024 * 1024))
+
+# Downloaded files are kept once in a content-addressed store (default OP_DIR/.futurelearn-dl.store)
+# hard linked into the course directories, so that assets shared by several courses or
+# course runs are only downloaded and stored once
+STORE = os.getenv('FL_STORE', default='1') != '0'
+
+# Video quality policy (may be overridden per course):
+# - sd:       always the SD rendition
+# - hd:       the HD rendition when the video has one
+# - best:     the larger of the two renditions (by Content-Length)
+# - smallest: the smaller of the two renditions
+# - auto:     HD, dropping to SD once the run would exceed TIME_BUDGET seconds or BYTE_BUDGET
+#             bytes at the throughput achieved so far (0 = no budget)
+QUALITY_MODES = [ 'sd', 'hd', 'best', 'smallest', 'auto' ]
+QUALITY     = os.getenv('FL_QUALITY', default='hd')
+TIME_BUDGET = float(os.getenv('FL_TIME_BUDGET', default=0))
+BYTE_BUDGET = int(os.getenv('FL_BYTE_BUDGET', default=0))
+
+# Download file types by extension (case insensitive):
+#DOWNLOAD_TYPES = [ 'pdf', 'mp4', 'mp3', 'doc', 'docx', 'ppt', 'pptx', 'wmv' ]
+#DOWNLOAD_TYPES = [ 'pdf', 'mp4' ]
+#DOWNLOAD_TYPES = [ 'pdf' ]
+#DOWNLOAD_TYPES = [ 'mp4' ]
+#DOWNLOAD_TYPES = [ 'pdf', 'mp4', 'mp3', 'ppt', 'pptx', 'wmv' ]
+# Other registered types (see --list-types) can be selected with --types or FL_DOWNLOAD_TYPES
+DOWNLOAD_TYPES = os.getenv('FL_DOWNLOAD_TYPES', default='pdf,mp4,vtt').split(',')
+for d in range(len(DOWNLOAD_TYPES)):
+    DOWNLOAD_TYPES[d] = DOWNLOAD_TYPES[d].lower()
+
+# Order of the downloads (--schedule):
+# - page:  the order of the course pages
+# - type:  by the rank of their type in TYPE_PRIORITY ('*' for the other types), then page order
+# - small: smallest first, by the size recorded by a previous run or else the typical size of
+#          the elements the type is found in (TYPICAL_SIZE)
+# - week:  week by week across all of the courses, then page order
+SCHEDULES = [ 'page', 'type', 'small', 'week' ]
+SCHEDULE = os.getenv('FL_SCHEDULE', default='type')
+TYPE_PRIORITY = os.getenv('FL_TYPE_PRIORITY', default='vtt,pdf,*,mp4').split(',')
+TYPICAL_SIZE = { 'track': 50 * 1024, 'image': 500 * 1024, 'link': 2 * 1024 * 1024,
+                 'audio': 20 * 1024 * 1024, 'video': 200 * 1024 * 1024 }
+
+# Cap of the download throughput of this host (shared by its --processes), in bytes/sec with an optional K/M/G suffix
+# (0: none), and the local time windows downloads are allowed in, e.g. '19:00-07:00,sat-sun 00:00-24:00'
+# (empty: always). Transfers are paused at the end of a window, and resumed at the start of the next
+MAX_RATE = os.getenv('FL_MAX_RATE', default='0')
+WINDOWS  = os.getenv('FL_WINDOWS', default='')
+
+# Jobs of a shared job queue (--queue) are leased for JOB_LEASE seconds, renewed while the
+# worker holding them is alive, and retried up to JOB_ATTEMPTS times after a retryable failure.
+# Idle workers poll the queue every JOB_POLL seconds
+JOB_LEASE    = float(os.getenv('FL_JOB_LEASE', default=120))
+JOB_ATTEMPTS = int(os.getenv('FL_JOB_ATTEMPTS', default=3))
+JOB_POLL     = float(os.getenv('FL_JOB_POLL', default=2))
+
+# Number of processes re-hashing the files of OP_DIR with --verify:
+VERIFY_PROCESSES = int(os.getenv('FL_VERIFY_PROCESSES', default=os.cpu_count() or 1))
+
+# The text of the step pages is archived in OP_DIR/.futurelearn-dl.archive.db, searched with --search
+ARCHIVE = os.getenv('FL_ARCHIVE', default='1') != '0'
+SEARCH_LIMIT = int(os.getenv('FL_SEARCH_LIMIT', default=20))
+
+# Subtitle languages (data-srclang) to download as srt, or 'all'.
+# With several languages the srt files are named <video>.<lang>.srt
+SUBTITLE_LANGUAGES = os.getenv('FL_SUBTITLE_LANGS', default='en').lower().split(',')
+
+
+headers = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/29.0.1547.62 Safari/537.36',
+    'content-type': 'application/json',
+}
+
+## -- Functions: ---------------------------------------------------
+
+def fatal(msg):
+    ''' die brutally '''
+    print("FATAL:" + msg)
+    sys.exit(1)
+
+def debug(verbosity_level, msg):
+    if verbosity_level == 1:
+        #print("DEBUG: " + msg)
+        print(msg)
+        return
+
+    if VERBOSE >= verbosity_level and DEBUG:
+        print("DEBUG: " + msg)
+
+def mkdir_p(path):
+    '''
+         Perform equivalent of 'mkdir -p path' to create a directory and any necessary
+         parent directories
+    '''
+    try:
+        debug(2, "Creating dir <{}>".format(path))
+        os.makedirs(path)
+
+    except OSError as exc: # Python >2.5
+        if exc.errno == errno.EEXIST and os.path.isdir(path):
+            pass
+        else: raise
+
+def showResponse(response):
+    '''
+       Dump various fields of a http response
+    '''
+    print("url=" + response.url)
+    print("request=" + str(response.request))
+    print("request.method=" + str(response.request.method))
+    print("REQUEST headers(request)=" + str(response.request.headers))
+    print("RESPONSE cookies(response)=" + str(response.cookies))
+    print("RESPONSE len(response.content)=" + str(len(response.content)))
+    print("status_code=" + str(response.status_code))
+    print(str(response))
+    print("reason={}".format(str(response.reason)))
+    print("status_code={}".format(str(response.status_code)))
+    #print("content={}".format(str(response.content)))
+    print("encoding={}".format(str(response.encoding)))
+    print("headers={}".format(str(response.headers)))
+    print("history={}".format(str(response.history)))
+    print("is_redirect={}".format(str(response.is_redirect)))
+    print("ok={}".format(str(response.ok)))
+    print("links={}".format(str(response.links)))
+    print("raise_for_status={}".format(str(response.raise_for_status)))
+    print("raw={}".format(str(response.raw)))
+    print("text={}".format(str(response.text)))
+    print("url={}".format(str(response.url)))
+    print("json={}".format(str(response.json)))
+
+def writeFile(file, content):
+    ''' Write content to the specified file '''
+    f = open(file, 'w')
+    try:
+        f.write(content)
+    except UnicodeEncodeError as exc:
+        print("ERROR: UnicodeEncodeError - " + str( exc ))
+        pass
+    f.close()
+
+def getInteger(content, ipos):
+    '''
+       Return the integer value, if any, in content starting at position ipos
+       RETURNS: the integers string
+    '''
+    # Build up integer:
+    ivalue = ''
+    while content[ipos].isdigit():
+        ivalue  += content[ipos]
+        ipos += 1
+
+    return ivalue
+
+def showDownloads(label, urls):
+    print("-- " + label + ": Downloadable urls found: -----------")
+
+    for type in urls:
+        if len(urls[type]) != 0:
+            print(type + ": ", end='')
+            for url in urls[type]:
+                print("-- " + url)
+
+def pause(msg):
+    if PAUSE:
+        print(msg)
+        print("Press <return> to continue")
+        input()
+
+'''
+     Downloadable items are found by a single scan of each step page for these sources:
+     - link:      <a href="URL">
+     - image:     <img src="URL">
+     - video:     <video ... data-hd-src="..."><source src="URL" type="video/mp4" />
+     - audio:     <audio src="URL"> or <audio ...><source src="URL" />
+     - track:     <div class="track" data-src="URL" data-srclang="en">
+     - embed:     <iframe src="URL">
+     each url found being offered to the asset types (see ASSET_TYPES) selected for its source.
+
+     MP4:
+     <video poster="//view.vzaar.com/2088550/image" width="auto" height="auto" id="video-2088550" class="video-js vjs-futurelearn-skin" controls="controls" preload="none" data-hd-src="//view.vzaar.com/2088550/video/hd" data-sd-src="//view.vzaar.com/2088550/video"><source src="//view.vzaar.com/2088550/video" type="video/mp4" />
+'''
+ASSET_REGC = re.compile(r'''<a href=(?P<aq>["'])(?P<href>.*?)(?P=aq)'''
+                        r'''|<(?P<media>video|audio)\b(?P<media_attrs>[^>]*)>'''
+                        r'''|<source src=(?P<sq>["'])(?P<src>.*?)(?P=sq)'''
+                        r'''|<div class="track" data-src=(?P<tq>["'])(?P<track>.*?)(?P=tq)(?P<track_attrs>[^>]*)>'''
+                        r'''|<(?P<tag>img|iframe)\b[^>]*?\ssrc=(?P<iq>["'])(?P<tag_src>.*?)(?P=iq)''',
+                        re.IGNORECASE | re.DOTALL)
+
+SRCLANG_REGC = re.compile(r'''data-srclang=["']?([\w-]*)''', re.IGNORECASE)
+MEDIA_SRC_REGC = re.compile(r'''\ssrc=["']([^"']*)''', re.IGNORECASE)
+
+def getDownloadableURLs(content, download_types, tracks=None, languages=None, url_scheme='https:'):
+    '''
+       Scan the content of a step page once for all of the download_types.
+       If tracks is given, it is filled with vtt url -> (url of the video it captions, language)
+       Only subtitles in languages (default: SUBTITLE_LANGUAGES) are kept, and "//host/path"
+       urls get the url_scheme of the site
+
+       RETURNS: dict of download type -> list of urls, in page order
+    '''
+    if languages is None:
+        languages = SUBTITLE_LANGUAGES
+
+    asset_types = [ getAssetType(DOWNLOAD_TYPE) for DOWNLOAD_TYPE in download_types ]
+    urls = { asset_type.name: [] for asset_type in asset_types }
+    urls_seen = set()
+
+    by_source = {}
+    for asset_type in asset_types:
+        for source in asset_type.sources:
+            by_source.setdefault(source, []).append(asset_type)
+
+    # Attribute quotes may be escaped within inline scripts:
+    content = content.replace('\\"', '"')
+
+    # Videos are only downloaded if there's a mention of such media in the page:
+    if not 'video/mp4' in content.lower():
+        by_source.pop('video', None)
+
+    def addURLs(source, url, pos, lang=None):
+        for asset_type in by_source.get(source, []):
+            type_url = asset_type.normalise(url)
+            if type_url == '' or (asset_type.name, type_url) in urls_seen:
+                continue
+            debug(4, "MATCHING URL=<<{}>>".format(type_url))
+            urls_seen.add( (asset_type.name, type_url) )
+            urls[asset_type.name].append(type_url)
+            if source == 'track':
+                track_urls.append( (pos, type_url, lang) )
+
+    media = None
+    videos = []
+    track_urls = []
+    for match in ASSET_REGC.finditer(content):
+        url = match.group('href') or match.group('src') or match.group('track') or match.group('tag_src') or ''
+        media_attrs = match.group('media_attrs')
+        if media_attrs is not None:
+            # <audio src="URL"> has no <source>:
+            media_src = MEDIA_SRC_REGC.search(media_attrs)
+            if media_src and match.group('media').lower() == 'audio':
+                url = media_src.group(1)
+                media_attrs = None
+
+        # Detect if just "//url" and insert https:
+        if url[0:2] == "//":
+            url = url_scheme + url
+
+        if media_attrs is not None:
+            media = (match.group('media').lower(), media_attrs.lower())
+
+        elif match.group('media') is not None:
+            addURLs('audio', url, match.start())
+
+        elif match.group('src') is not None:
+            # Only the first source of a <video>/<audio> is downloaded:
+            if media is None:
+                continue
+            kind, attrs = media
+            media = None
+            if kind == 'video':
+                url = getVideoURL(url, attrs)
+                videos.append( (match.start(), url) )
+            addURLs(kind, url, match.start())
+
+        elif match.group('track') is not None:
+            lang = SRCLANG_REGC.search(match.group('track_attrs'))
+            lang = lang.group(1).lower() if lang else languages[0]
+            if not lang in languages and languages != ['all']:
+                continue
+            addURLs('track', url, match.start(), lang)
+
+        elif match.group('tag') is not None:
+            addURLs('image' if match.group('tag').lower() == 'img' else 'embed', url, match.start())
+
+        else:
+            addURLs('link', url, match.start())
+
+    if tracks is not None:
+        for pos, url, lang in track_urls:
+            tracks[url] = (getTrackVideo(videos, pos, url), lang)
+
+    return urls
+
+def getVideoURL(src, attrs):
+    '''
+       RETURNS: the download url of the video of the <source> src of a <video> with attributes attrs:
+                its HD rendition if the video has one
+    '''
+    url = src[:-5] + 'download'
+    if 'data-hd-src=' in attrs:
+        url = url + '/hd'
+    return url
+
+def getTrackVideo(videos, pos, track_url):
+    '''
+       Bind a subtitle track found at pos in a step page to one of the (pos, url) videos of the page:
+       the video whose id appears in the track url, else the closest video before the track,
+       else the first video after it
+
+       RETURNS: the url of the video, or None if the page has no video
+    '''
+    for vpos, url in videos:
+        video_id = url[ :url.find('/download') ]
+        video_id = video_id[ video_id.rfind('/') + 1: ]
+        if video_id and re.search(r'(^|\D)' + re.escape(video_id) + r'(\D|$)', track_url[ track_url.rfind('/'): ]):
+            return url
+
+    before = [ url for vpos, url in videos if vpos < pos ]
+    if before:
+        return before[-1]
+    if videos:
+        return videos[0][1]
+    return None
+
+def matchURLType(url, DOWNLOAD_TYPE):
+    '''
+       Check that the url ends with the type e.g. ".pdf", possibly followed by a 15 char suffix
+
+       RETURNS: the url without any suffix, or '' if it doesn't match
+    '''
+    lurl = url.lower()
+    if lurl[-(1+len(DOWNLOAD_TYPE)):] == "." + DOWNLOAD_TYPE:
+        return url
+    elif lurl[-(1 + len(DOWNLOAD_TYPE) + 15):-15] == "." + DOWNLOAD_TYPE:
+        return url[:-15]
+    return ''
+
+def isBadContent(response, head):
+    ''' Sniff the content-type and the first bytes of a download response for the
+        error document returned when a video isn't available yet
+        RETURN: True if the content should not be saved
+    '''
+    content_type = response.headers.get('content-type', '').lower()
+    if not 'xml' in content_type and not head.lstrip()[:1] == b'<':
+        return False
+
+    return SIGNATURE_ERROR in head[:SNIFF_SIZE].decode('utf8', 'ignore')
+
+def isCompleteFile(file, DOWNLOAD_TYPE, size=None):
+    ''' RETURNS: True if file has the size recorded for it (if known) and starts like a file of its type '''
+    if size is not None and os.path.getsize(file) != size:
+        return False
+    with open(file, 'rb') as f:
+        head = f.read(SNIFF_SIZE)
+    return getAssetType(DOWNLOAD_TYPE).isValidContent(head)
+
+class TransferPaused(Exception):
+    ''' Raised when a download is interrupted by the end of its time window '''
+    pass
+
+class IncompleteDownload(Exception):
+    ''' Raised when a download ends before Content-Length bytes were received '''
+    pass
+
+def readPartInfo(partfile):
+    ''' RETURNS: the etag/length recorded when partfile was started, or None '''
+    if not os.path.exists(partfile) or not os.path.exists(partfile + '.json'):
+        return None
+
+    with open(partfile + '.json', 'r') as f:
+        return json.load(f)
+
+def removePartFile(partfile):
+    for file in (partfile, partfile + '.json'):
+        if os.path.exists(file):
+            os.remove(file)
+
+def writeFileAtomic(file, content):
+    ''' Write content to file via a temp file, so readers never see a partial file '''
+    tmpfile = '{}.{}.tmp'.format(file, os.urandom(6).hex())
+    # Created as open() would, the kernel applying the umask (mkstemp makes it owner only):
+    fd = os.open(tmpfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(tmpfile, file)
+
+## -- Metrics: -----------------------------------------------------
+
+# Metrics are kept for the whole process, summed over all clients and courses
+metrics = { 'counters': {}, 'timings': {}, 'gauges': {} }
+metrics_lock = threading.Lock()
+run_start = monotonic()
+
+def countMetric(name, n=1):
+    ''' Add n to the counter name '''
+    with metrics_lock:
+        metrics['counters'][name] = metrics['counters'].get(name, 0) + n
+
+def gaugeMetric(name, value):
+    ''' Set the gauge name, remembering its maximum '''
+    with metrics_lock:
+        metrics['gauges'][name] = value
+        metrics['gauges'][name + '_max'] = max(value, metrics['gauges'].get(name + '_max', value))
+
+def timeMetric(name, seconds):
+    ''' Record one duration of the phase name '''
+    with metrics_lock:
+        timing = metrics['timings'].setdefault(name, { 'count': 0, 'sum': 0.0, 'max': 0.0 })
+        timing['count'] += 1
+        timing['sum'] += seconds
+        timing['max'] = max(timing['max'], seconds)
+
+@contextmanager
+def timed(name):
+    ''' Time the enclosed block as one duration of the phase name '''
+    start = monotonic()
+    try:
+        yield
+    finally:
+        timeMetric(name, monotonic() - start)
+
+def getCounter(name):
+    return metrics['counters'].get(name, 0)
+
+def parseBytes(text):
+    ''' RETURNS: the number of bytes of text, e.g. 500K, 2M, 1.5G '''
+    text = str(text).strip().upper()
+    scale = { 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3 }.get(text[-1:], 1)
+    if scale != 1:
+        text = text[:-1]
+    return int(float(text) * scale)
+
+def formatBytes(nbytes):
+    for unit in [ 'B', 'KB', 'MB', 'GB' ]:
+        if nbytes < 1024 or unit == 'GB':
+            return "{:.1f}{}".format(nbytes, unit)
+        nbytes /= 1024.0
+
+def getRunMetrics():
+    ''' RETURNS: the metrics of this run, with derived rates '''
+    with metrics_lock:
+        run = json.loads(json.dumps(metrics))
+
+    elapsed = monotonic() - run_start
+    counters = run['counters']
+    pages = counters.get('cache_hits', 0) + counters.get('cache_revalidated', 0) + counters.get('cache_misses', 0)
+    run['elapsed_seconds'] = elapsed
+    run['bytes_per_second'] = counters.get('bytes_downloaded', 0) / elapsed if elapsed else 0
+    run['cache_hit_rate'] = (counters.get('cache_hits', 0) + counters.get('cache_revalidated', 0)) / pages if pages else 0
+    return run
+
+def writeMetrics(json_file, prom_file=None):
+    '''
+       Save the metrics of this run as json, and optionally as a Prometheus textfile
+       (for the node_exporter textfile collector)
+    '''
+    run = getRunMetrics()
+    # The throughput estimated by --plan is the last one measured: a run which downloaded nothing keeps it
+    if run['counters'].get('bytes_downloaded'):
+        run['throughput'] = { 'bytes_per_second': run['bytes_per_second'],
+                              'download_workers': run['gauges'].get('download_workers', 1) }
+    elif os.path.exists(json_file):
+        with open(json_file, 'r') as f:
+            run['throughput'] = json.load(f).get('throughput')
+    writeFileAtomic(json_file, json.dumps(run, indent=1).encode('utf8'))
+
+    debug(1, "Downloaded {} files, {} in {:.0f}s ({}/s), page cache hit rate {:.0%}".format(
+          run['counters'].get('files_downloaded', 0), formatBytes(run['counters'].get('bytes_downloaded', 0)),
+          run['elapsed_seconds'], formatBytes(run['bytes_per_second']), run['cache_hit_rate']))
+
+    if not prom_file:
+        return
+
+    lines = []
+    for name, value in sorted(run['counters'].items()):
+        lines.append('# TYPE futurelearn_dl_{}_total counter'.format(name))
+        lines.append('futurelearn_dl_{}_total {}'.format(name, value))
+    for name, value in sorted(run['gauges'].items()):
+        lines.append('# TYPE futurelearn_dl_{} gauge'.format(name))
+        lines.append('futurelearn_dl_{} {}'.format(name, value))
+    lines.append('# TYPE futurelearn_dl_phase_seconds summary')
+    for name, timing in sorted(run['timings'].items()):
+        lines.append('futurelearn_dl_phase_seconds_sum{{phase="{}"}} {}'.format(name, timing['sum']))
+        lines.append('futurelearn_dl_phase_seconds_count{{phase="{}"}} {}'.format(name, timing['count']))
+    lines.append('# TYPE futurelearn_dl_phase_seconds_max gauge')
+    for name, timing in sorted(run['timings'].items()):
+        lines.append('futurelearn_dl_phase_seconds_max{{phase="{}"}} {}'.format(name, timing['max']))
+    for name in [ 'elapsed_seconds', 'bytes_per_second', 'cache_hit_rate' ]:
+        lines.append('# TYPE futurelearn_dl_{} gauge'.format(name))
+        lines.append('futurelearn_dl_{} {}'.format(name, run[name]))
+    lines.append('futurelearn_dl_last_run_timestamp_seconds {}'.format(time()))
+
+    writeFileAtomic(prom_file, ('\n'.join(lines) + '\n').encode('utf8'))
+
+## -- HTTP requests: -----------------------------------------------
+
+class RequestFailed(Exception):
+    ''' Raised when a request fails: retryable tells whether a later run may succeed '''
+    def __init__(self, url, reason, retryable):
+        Exception.__init__(self, "{} <{}>".format(reason, url))
+        self.url = url
+        self.reason = reason
+        self.retryable = retryable
+
+def getRetryAfter(response):
+    ''' RETURNS: the seconds to wait from the Retry-After header of response, or None '''
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    if retry_after.isdigit():
+        return min(BACKOFF_MAX, int(retry_after))
+    try:
+        return min(BACKOFF_MAX, max(0, parsedate_to_datetime(retry_after).timestamp() - time()))
+    except (TypeError, ValueError):
+        return None
+
+def checkResponse(response, expected=(200,)):
+    ''' RAISES: RequestFailed (permanent) if the status of response isn't in expected '''
+    if not response.status_code in expected:
+        response.close()
+        raise RequestFailed(response.url, 'HTTP {}'.format(response.status_code), False)
+
+def createSession(pool_size):
+    '''
+       Create the session shared by all page fetches and downloads, keeping up to
+       pool_size connections open to each host
+
+       RETURNS: the session
+    '''
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+## -- Download scheduler: ------------------------------------------
+
+class TokenBucket:
+    '''
+       Token bucket rate limiter: allows 'rate' acquisitions per second on average,
+       with bursts of up to 'burst' acquisitions
+    '''
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        '''
+           Block until tokens are available, then take them. Acquisitions larger than a burst
+           wait for a full bucket, and make the next ones wait for the excess
+        '''
+        needed = min(tokens, self.burst)
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return
+                wait = (needed - self.tokens) / self.rate
+            sleep(wait)
+
+    def hold(self, seconds):
+        ''' Make the next acquisition wait for at least seconds '''
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+WINDOW_REGC = re.compile(r'^(?:(mon|tue|wed|thu|fri|sat|sun)(?:-(mon|tue|wed|thu|fri|sat|sun))?\s+)?(\d\d?):(\d\d)-(\d\d?):(\d\d)$')
+WEEKDAYS = [ 'mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun' ]
+
+def parseWindows(text):
+    '''
+       Parse comma separated time windows '[<day>[-<day>] ]HH:MM-HH:MM', e.g. '19:00-07:00' or
+       'sat-sun 00:00-24:00'. A window ending before it starts ends on the next day
+
+       RETURNS: list of (weekdays, start minute, end minute), weekdays being a set of 0 (monday) to 6
+       RAISES: ValueError if a window isn't valid
+    '''
+    windows = []
+    for window in text.lower().split(','):
+        if not window.strip():
+            continue
+        match = WINDOW_REGC.match(window.strip())
+        if not match:
+            raise ValueError("invalid time window '{}'".format(window.strip()))
+        first_day, last_day, start_h, start_m, end_h, end_m = match.groups()
+        start_h, start_m, end_h, end_m = int(start_h), int(start_m), int(end_h), int(end_m)
+        # A window may end at 24:00, but no other time is past 23:59:
+        if start_h > 23 or start_m > 59 or end_m > 59 or end_h > 24 or ( end_h == 24 and end_m != 0 ):
+            raise ValueError("invalid time in time window '{}'".format(window.strip()))
+        if first_day:
+            first, last = WEEKDAYS.index(first_day), WEEKDAYS.index(last_day or first_day)
+            days = set([ day % 7 for day in range(first, last + 1 if last >= first else last + 8) ])
+        else:
+            days = set(range(7))
+        windows.append( (days, start_h * 60 + start_m, end_h * 60 + end_m) )
+    return windows
+
+def isInWindows(windows, when):
+    ''' RETURNS: True if the datetime when is within one of the time windows '''
+    minute = when.hour * 60 + when.minute
+    day = when.weekday()
+    for days, start, end in windows:
+        if start < end:
+            if day in days and start <= minute < end:
+                return True
+        elif ( day in days and minute >= start ) or ( (day - 1) % 7 in days and minute < end ):
+            return True
+    return False
+
+def getWindowsShare(windows):
+    ''' RETURNS: the share of the minutes of a week within one of the time windows (1 if there are none) '''
+    if not windows:
+        return 1.0
+    monday = datetime(2024, 1, 1)
+    minutes = 7 * 24 * 60
+    return len([ minute for minute in range(minutes) if isInWindows(windows, monday + timedelta(minutes=minute)) ]) / minutes
+
+def getWindowWait(windows, now=None):
+    ''' RETURNS: the number of seconds until the next of the time windows opens, 0 if one is open '''
+    now = now or datetime.now()
+    if isInWindows(windows, now):
+        return 0
+    start = now.replace(second=0, microsecond=0)
+    for minutes in range(1, 8 * 24 * 60):
+        when = start + timedelta(minutes=minutes)
+        if isInWindows(windows, when):
+            return (when - now).total_seconds()
+    return 0
+
+## -- Blob store: ---------------------------------------------------
+
+class BlobStore:
+    '''
+       Content-addressed store of downloaded files, shared by all courses and runs:
+       each file is kept once as blobs/<sha256[:2]>/<sha256>, and course directories
+       hold hard links to the blobs.
+       The index maps the stable key of an asset (its type and url) to its blob, so that
+       an asset already held is linked into place without any request
+    '''
+    def __init__(self, dir):
+        self.dir = dir
+        mkdir_p(dir + '/blobs')
+        self.db = sqlite3.connect(dir + '/index.db', check_same_thread=False, timeout=60)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS blobs (
+                              key TEXT PRIMARY KEY, sha256 TEXT, size INTEGER, updated REAL )''')
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def getKey(self, entry):
+        ''' RETURNS: the stable key of a manifest entry: the same asset has the same key in every course run '''
+        return entry['type'] + ':' + entry.get('download_url', entry['url'])
+
+    def getBlobFile(self, sha256):
+        return self.dir + '/blobs/' + sha256[:2] + '/' + sha256
+
+    def fetch(self, entry):
+        '''
+           Link the blob of a known asset to the file of entry
+
+           RETURNS: dict of the size, etag and sha256 of the file, or None if the asset isn't held
+        '''
+        with self.lock:
+            row = self.db.execute('SELECT sha256, size FROM blobs WHERE key=?', (self.getKey(entry),)).fetchone()
+        if row is None:
+            return None
+
+        sha256, size = row
+        blob = self.getBlobFile(sha256)
+        if not os.path.exists(blob) or os.path.getsize(blob) != size:
+            return None
+
+        debug(2, "Linking <{}> from the blob store".format(entry['file']))
+        linkFile(blob, entry['file'])
+        return { 'size': size, 'etag': None, 'sha256': sha256 }
+
+    def add(self, entry, info):
+        '''
+           Move the file of entry into the store, replacing it by a link to its blob.
+           A file whose content is already held is replaced by a link to the existing blob
+        '''
+        file = entry['file']
+        key = self.getKey(entry)
+        sha256 = info['sha256']
+        if sha256 is None:
+            # The rendition of a video which was already present isn't known:
+            if 'sd_url' in entry:
+                return
+            # Already present before this run: hash it once, unless already stored
+            with self.lock:
+                if self.db.execute('SELECT 1 FROM blobs WHERE key=?', (key,)).fetchone():
+                    return
+            sha256 = hashFile(file)
+
+        blob = self.getBlobFile(sha256)
+        mkdir_p(os.path.dirname(blob))
+        if not os.path.exists(blob) or os.path.getsize(blob) != os.path.getsize(file):
+            linkFile(file, blob)
+        elif not os.path.samefile(blob, file):
+            debug(2, "Deduplicated <{}>".format(file))
+            countMetric('store_bytes_saved', os.path.getsize(file))
+            linkFile(blob, file)
+
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)',
+                            (key, sha256, os.path.getsize(blob), time()))
+            self.db.commit()
+
+    def forget(self, sha256):
+        ''' Drop the blob sha256 (e.g. found corrupted), so that its assets are downloaded again '''
+        blob = self.getBlobFile(sha256)
+        if os.path.exists(blob):
+            os.remove(blob)
+        with self.lock:
+            self.db.execute('DELETE FROM blobs WHERE sha256=?', (sha256,))
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+def hashFile(file):
+    ''' RETURNS: the sha256 hex digest of file '''
+    sha256 = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def linkFile(src, dst):
+    '''
+       Atomically replace dst by a hard link to src, or by a copy of src where
+       hard links aren't possible (e.g. another filesystem)
+    '''
+    tmpfile = '{}.{}.{}.link'.format(dst, os.getpid(), threading.get_ident())
+    try:
+        os.link(src, tmpfile)
+    except OSError:
+        shutil.copyfile(src, tmpfile)
+    os.replace(tmpfile, dst)
+
+## -- Run journal: -------------------------------------------------
+
+class RunJournal:
+    '''
+       Append-only journal of a run, one json event per line, so that an interrupted run
+       can be resumed without crawling or downloading again what was already done:
+       - run:     the courses and options of the run
+       - page:    the parsed content of a course, week or step page
+       - queued:  a manifest entry queued for download
+       - started: a download started
+       - done:    a download completed (or found present)
+       A line torn by a crash is ignored when the journal is read back
+    '''
+    def __init__(self, file):
+        self.file = file
+        self.f = None
+        self.lock = threading.Lock()
+        self.run = None
+        self.pages = {}
+        self.queued = {}
+        self.done = set()
+
+    def load(self):
+        '''
+           Read back the journal of a previous run
+
+           RETURNS: True if there's a run to resume
+        '''
+        if not os.path.exists(self.file):
+            return False
+
+        with open(self.file, 'r') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    debug(1, "Ignoring torn journal line <{}>".format(line.strip()))
+                    continue
+                if event['event'] == 'run':
+                    self.run = event
+                elif event['event'] == 'page':
+                    self.pages[event['key']] = event['content']
+                elif event['event'] == 'queued':
+                    self.queued[getJobKey(event['entry'])] = event['entry']
+                elif event['event'] == 'done':
+                    self.done.add(event['key'])
+
+        debug(1, "Journal <{}>: {} pages, {} of {} downloads done".format(
+              self.file, len(self.pages), len(self.done), len(self.queued)))
+        return self.run is not None
+
+    def open(self, resume):
+        ''' Start writing the journal: appending to it if resuming, else starting a new one '''
+        self.f = open(self.file, 'a' if resume else 'w')
+
+    def write(self, event, **fields):
+        fields['event'] = event
+        line = json.dumps(fields) + '\n'
+        with self.lock:
+            self.f.write(line)
+            self.f.flush()
+            if event == 'run':
+                os.fsync(self.f.fileno())
+
+    def getPending(self):
+        ''' RETURNS: the entries queued by the journaled run which weren't downloaded '''
+        return [ entry for key, entry in self.queued.items() if not key in self.done ]
+
+    def getPage(self, key):
+        ''' RETURNS: the journaled content of page key, or None '''
+        with self.lock:
+            return self.pages.get(key)
+
+    def recordPage(self, key, content):
+        with self.lock:
+            self.pages[key] = content
+        self.write('page', key=key, content=content)
+
+    def recordQueued(self, entry):
+        ''' RETURNS: False if entry was already queued (by this or the journaled run) '''
+        key = getJobKey(entry)
+        with self.lock:
+            if key in self.queued:
+                return False
+            self.queued[key] = entry
+        self.write('queued', entry=entry)
+        return True
+
+    def close(self, finished):
+        ''' Stop writing the journal, removing it if the run finished '''
+        self.f.close()
+        if finished and os.path.exists(self.file):
+            os.remove(self.file)
+
+def getJobKey(entry):
+    return '{}/{}/{}'.format(entry['course_id'], entry['course_run'], entry['url'])
+
+## -- Job queue: ---------------------------------------------------
+
+class JobQueue:
+    '''
+       Download jobs shared by worker processes, on this host or on several hosts mounting the
+       same filesystem (whose clocks are synchronised), kept in an sqlite database:
+       - a coordinator crawls the courses and adds a job per manifest entry, once per entry
+       - a worker leases a pending job for JOB_LEASE seconds, renewing the lease while it runs:
+         the jobs of a dead worker are leased again once their lease has expired
+       - the queue is finished once the crawl is done and no job is pending or leased
+    '''
+    def __init__(self, file, lease_time=JOB_LEASE):
+        self.file = file
+        self.lease_time = lease_time
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(file, check_same_thread=False, timeout=60, isolation_level=None)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                             key TEXT PRIMARY KEY, entry TEXT, state TEXT, owner TEXT,
+                             lease_expires REAL, attempts INTEGER, updated REAL, priority REAL )''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+
+    def transaction(self, statements):
+        '''
+           Run statements, a list of (sql, parameters), in a single write transaction
+
+           RETURNS: the cursor of the last statement
+        '''
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                for sql, parameters in statements:
+                    cursor = self.db.execute(sql, parameters)
+                self.db.execute('COMMIT')
+            except:
+                self.db.execute('ROLLBACK')
+                raise
+        return cursor
+
+    def getMeta(self, name):
+        with self.lock:
+            row = self.db.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def setMeta(self, name, value):
+        self.transaction([ ('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (name, value)) ])
+
+    def startCrawl(self, check_url):
+        '''
+           Start (or restart) the crawl of a coordinator: the jobs of a previous crawl which
+           are done or failed are forgotten, pending and leased ones are kept
+        '''
+        self.transaction([ ("DELETE FROM jobs WHERE state IN ('done', 'failed')", ()),
+                           ('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', ('crawl_done', '0')),
+                           ('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', ('check_url', check_url)) ])
+
+    def put(self, entry, priority=0):
+        ''' Add the job of a manifest entry, leased before the jobs of higher priority. RETURNS: False if it was already queued '''
+        cursor = self.transaction([ ("INSERT OR IGNORE INTO jobs (key, entry, state, attempts, updated, priority) VALUES (?, ?, 'pending', 0, ?, ?)",
+                                     (getJobKey(entry), json.dumps(entry), time(), priority)) ])
+        return cursor.rowcount == 1
+
+    def lease(self, owner):
+        ''' RETURNS: the entry of a pending job (or of an expired lease) now leased by owner, or None '''
+        now = time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute('''SELECT key, entry FROM jobs
+                                         WHERE state = 'pending' OR ( state = 'leased' AND lease_expires < ? )
+                                         ORDER BY priority, rowid LIMIT 1''', (now,)).fetchone()
+                if row:
+                    self.db.execute("UPDATE jobs SET state = 'leased', owner = ?, lease_expires = ?, updated = ? WHERE key = ?",
+                                    (owner, now + self.lease_time, now, row[0]))
+                self.db.execute('COMMIT')
+            except:
+                self.db.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return json.loads(row[1])
+
+    def renew(self, owner_prefix):
+        ''' Extend the leases held by the workers whose owner starts with owner_prefix '''
+        self.transaction([ ("UPDATE jobs SET lease_expires = ? WHERE state = 'leased' AND owner LIKE ?",
+                            (time() + self.lease_time, owner_prefix + '%')) ])
+
+    def complete(self, entry, owner, failure=None):
+        '''
+           Release the job of entry leased by owner: done, or after a failure pending again
+           (if retryable and it has attempts left) or failed
+        '''
+        if failure is None:
+            state = "'done'"
+        elif failure['retryable']:
+            state = "CASE WHEN attempts + 1 < {} THEN 'pending' ELSE 'failed' END".format(JOB_ATTEMPTS)
+        else:
+            state = "'failed'"
+        self.transaction([ ('''UPDATE jobs SET state = {}, attempts = attempts + 1, owner = NULL, updated = ?
+                               WHERE key = ? AND owner = ?'''.format(state), (time(), getJobKey(entry), owner)) ])
+
+    def finishCrawl(self):
+        self.setMeta('crawl_done', '1')
+
+    def isFinished(self):
+        ''' RETURNS: True once the crawl is done and no job is left pending or leased '''
+        if self.getMeta('crawl_done') != '1':
+            return False
+        with self.lock:
+            row = self.db.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('pending', 'leased')").fetchone()
+        return row[0] == 0
+
+    def getCounts(self):
+        ''' RETURNS: the number of jobs in each state '''
+        with self.lock:
+            return dict(self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+
+    def close(self):
+        self.db.close()
+
+def getWorkerName():
+    ''' RETURNS: the name of this worker process, which prefixes the lease owner of its threads '''
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+## -- Step archive: ------------------------------------------------
+
+class StepArchive:
+    '''
+       Offline archive of the text of the step pages, in an sqlite database: the text of
+       each step is kept zlib compressed, keyed by course run and step (with its week),
+       and indexed by an FTS5 full-text index which doesn't hold a second copy of the text
+    '''
+    def __init__(self, file):
+        self.file = file
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(file, check_same_thread=False, timeout=60)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS steps (
+                             id INTEGER PRIMARY KEY, course_id TEXT, course_run INTEGER,
+                             week_num INTEGER, step_id TEXT, title TEXT, text BLOB, sha256 TEXT,
+                             updated REAL, UNIQUE (course_id, course_run, step_id) )''')
+        try:
+            self.db.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS steps_fts USING fts5 (
+                                 title, text, content='', tokenize='porter unicode61' )''')
+        except sqlite3.OperationalError:
+            # e.g. "no such module: fts5", if sqlite was built without it
+            self.db.close()
+            raise
+        self.db.commit()
+
+    def addStep(self, course_id, course_run, week_num, step_id, title, text):
+        '''
+           Archive (and index) the text of a step, unless it is already archived unchanged
+
+           RETURNS: True if the step was new or changed
+        '''
+        sha256 = hashlib.sha256((title + '\n' + text).encode('utf8')).hexdigest()
+        with self.lock:
+            row = self.db.execute('SELECT id, title, text, sha256 FROM steps WHERE course_id=? AND course_run=? AND step_id=?',
+                                  (course_id, course_run, step_id)).fetchone()
+            if row and row[3] == sha256:
+                return False
+
+            compressed = zlib.compress(text.encode('utf8'))
+            if row:
+                # A contentless index is updated by deleting the old values:
+                step_num = row[0]
+                self.db.execute("INSERT INTO steps_fts (steps_fts, rowid, title, text) VALUES ('delete', ?, ?, ?)",
+                                (step_num, row[1], zlib.decompress(row[2]).decode('utf8')))
+                self.db.execute('UPDATE steps SET week_num=?, title=?, text=?, sha256=?, updated=? WHERE id=?',
+                                (week_num, title, compressed, sha256, time(), step_num))
+            else:
+                step_num = self.db.execute('''INSERT INTO steps (course_id, course_run, week_num, step_id, title, text, sha256, updated)
+                                              VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                                           (course_id, course_run, week_num, step_id, title, compressed, sha256, time())).lastrowid
+            self.db.execute('INSERT INTO steps_fts (rowid, title, text) VALUES (?, ?, ?)', (step_num, title, text))
+            self.db.commit()
+        countMetric('steps_archived')
+        return True
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        '''
+           Search the archived steps with an FTS5 query (words, "phrases", AND/OR/NOT, prefix*)
+
+           RETURNS: list of dicts of the course_id, course_run, week_num, step_id, title and
+                    text of the best matching steps
+           RAISES: sqlite3.OperationalError if query isn't a valid FTS5 query
+        '''
+        with self.lock:
+            rows = self.db.execute('''SELECT course_id, course_run, week_num, step_id, steps.title, steps.text
+                                     FROM steps_fts JOIN steps ON steps.id = steps_fts.rowid
+                                     WHERE steps_fts MATCH ? ORDER BY rank LIMIT ?''', (query, limit)).fetchall()
+        return [ { 'course_id': course_id, 'course_run': course_run, 'week_num': week_num, 'step_id': step_id,
+                   'title': title, 'text': zlib.decompress(text).decode('utf8') }
+                 for course_id, course_run, week_num, step_id, title, text in rows ]
+
+    def close(self):
+        self.db.close()
+
+def getSnippet(text, query, width=100):
+    ''' RETURNS: the line of text around the first word of query found in it '''
+    text = ' '.join(text.split())
+    pos = -1
+    for word in re.findall(r'\w+', query):
+        if word in [ 'AND', 'OR', 'NOT', 'NEAR' ]:
+            continue
+        pos = text.lower().find(word.lower())
+        if pos >= 0:
+            break
+    start = max(0, pos - width // 2)
+    return ('...' if start > 0 else '') + text[start:start + width] + ('...' if start + width < len(text) else '')
+
+## -- Subtitles: ----------------------------------------------------
+
+def iterTextLines(chunks):
+    '''
+       Decode the utf8 text arriving in chunks of bytes, splitting it into lines as it arrives:
+       a line, or a CRLF, split between two chunks is only yielded once complete
+
+       RETURNS: generator of the lines, without their line ends
+    '''
+    decoder = codecs.getincrementaldecoder('utf8')('replace')
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.splitlines(True)
+        # The last line goes on in the next chunk, unless ended by a LF (a CR may be followed by one):
+        pending = lines.pop() if lines and not lines[-1].endswith('\n') else ''
+        for line in lines:
+            yield line.splitlines()[0]
+    pending += decoder.decode(b'', True)
+    for line in pending.splitlines():
+        yield line
+
+VTT_TIME_REGC = re.compile(r"(?:(\d{2,}):)?(\d{2}):(\d{2})\.(\d{3})\s+-->\s+(?:(\d{2,}):)?(\d{2}):(\d{2})\.(\d{3})")
+
+def convertVTTLines(lines):
+    '''
+       Convert WebVTT lines to SRT: cues are numbered, timings converted to the
+       'HH:MM:SS,mmm --> HH:MM:SS,mmm' form, and the header, notes and cue settings dropped
+
+       RETURNS: generator of srt lines
+    '''
+    linenum = 1
+    timeline = False
+    for line in lines:
+        line = line.rstrip('\r\n')
+        match = VTT_TIME_REGC.search(line)
+        if match or timeline:
+            if not timeline:
+                yield "%d\n" % linenum
+                linenum += 1
+            timeline = True
+            if match:
+                h1, m1, s1, ms1, h2, m2, s2, ms2 = match.groups()
+                line = "{}:{}:{},{} --> {}:{}:{},{}".format(h1 or '00', m1, s1, ms1, h2 or '00', m2, s2, ms2)
+            if len(line.strip()) == 0:
+                timeline = False
+            yield line + '\n'
+
+def convertVTTFile(vttfile, srtfile):
+    ''' Convert the vtt file vttfile to the srt file srtfile '''
+    with timed('vtt_conversion'), open(vttfile, 'r', encoding='utf8', errors='ignore') as f:
+        writeFileAtomic(srtfile, ''.join(convertVTTLines(f)).encode('utf8'))
+
+def convertVTTDirectory(dir):
+    '''
+       Convert every vtt file below dir to an srt file of the same name
+
+       RETURNS: the number of files converted
+    '''
+    num_files = 0
+    for root, dirs, files in os.walk(dir):
+        for name in sorted(files):
+            if name.lower().endswith('.vtt'):
+                vttfile = os.path.join(root, name)
+                debug(1, "Converting <{}>".format(vttfile))
+                convertVTTFile(vttfile, vttfile[:-len('.vtt')] + '.srt')
+                num_files += 1
+
+    return num_files
+
+## -- Asset types: --------------------------------------------------
+
+class AssetType:
+    '''
+       Handler of one type of downloadable asset:
+       - sources:     the page elements scanned for it (see ASSET_REGC)
+       - normalise:   function(url) returning the url to download, or '' if url isn't of this type
+                      (default: url ends with '.<name>', see matchURLType)
+       - filename:    function(course, entry, file_num, videos) returning the file of a manifest entry
+                      (default: the NN_<last part of the url> file of its week)
+       - postprocess: optional function converting the lines of the download on the fly (e.g. vtt to srt)
+       - fetch:       optional function(client, entry) replacing the download, returning its info
+       - numbered:    whether files of this type take a number in their week
+       - magic:       the (offset, bytes[, mask]) signatures one of which files of this type start with,
+                      so that e.g. an html error page saved as .mp4 is caught (default: FILE_MAGIC,
+                      see matchSignature)
+    '''
+    def __init__(self, name, sources=('link',), normalise=None, filename=None, postprocess=None, fetch=None,
+                 numbered=True, description='', magic=None):
+        self.name = name
+        self.sources = sources
+        self.normalise = normalise or (lambda url: matchURLType(url, name))
+        self.filename = filename or getLinkFile
+        self.postprocess = postprocess
+        self.fetch = fetch
+        self.numbered = numbered
+        self.description = description
+        self.magic = FILE_MAGIC.get(name, ()) if magic is None else magic
+
+    def isValidContent(self, head):
+        ''' RETURNS: False if head, the first bytes of a file, isn't the start of a file of this type '''
+        if not self.magic:
+            return True
+        return any([ matchSignature(head, *magic) for magic in self.magic ])
+
+# Leading bytes searched for a signature of no fixed offset:
+MAGIC_SEARCH_SIZE = 1024
+
+def matchSignature(head, offset, signature, mask=None):
+    '''
+       RETURNS: True if head has signature at offset (anywhere within its first MAGIC_SEARCH_SIZE
+                bytes if offset is None), only the bits set in mask being compared if given
+    '''
+    if offset is None:
+        return signature in head[:MAGIC_SEARCH_SIZE]
+    data = head[offset:offset + len(signature)]
+    if mask is None:
+        return data == signature
+    return len(data) == len(signature) and all([ byte & bits == sig & bits for byte, sig, bits in zip(data, signature, mask) ])
+
+# Signatures of the files of the download types which have one (pdf readers accept junk before
+# the header, and an mp3 without an ID3 tag starts with the 11 bit sync of an MPEG audio frame):
+FILE_MAGIC = {
+    'pdf':  [ (None, b'%PDF') ],
+    'mp4':  [ (4, b'ftyp') ],
+    'm4a':  [ (4, b'ftyp') ],
+    'wmv':  [ (0, b'\x30\x26\xb2\x75') ],
+    'mp3':  [ (0, b'ID3'), (0, b'\xff\xe0', b'\xff\xe0') ],
+    'ogg':  [ (0, b'OggS') ],
+    'wav':  [ (0, b'RIFF') ],
+    'png':  [ (0, b'\x89PNG') ],
+    'jpg':  [ (0, b'\xff\xd8\xff') ],
+    'jpeg': [ (0, b'\xff\xd8\xff') ],
+    'gif':  [ (0, b'GIF8') ],
+}
+for name in [ 'zip', 'docx', 'pptx', 'xlsx', 'odt', 'epub' ]:
+    FILE_MAGIC[name] = [ (0, b'PK\x03\x04') ]
+for name in [ 'doc', 'ppt', 'xls' ]:
+    FILE_MAGIC[name] = [ (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1') ]
+
+ASSET_TYPES = {}
+
+def registerAssetType(asset_type):
+    ''' Make asset_type selectable as a download type '''
+    ASSET_TYPES[asset_type.name] = asset_type
+    return asset_type
+
+def getAssetType(name):
+    ''' RETURNS: the registered handler of the download type name, else a handler of links to '.<name>' files '''
+    return ASSET_TYPES.get(name) or AssetType(name)
+
+def getWeekDir(course, entry):
+    return course.download_dir + '/Week_' + "%02d" % entry['week_num']
+
+def getLinkFile(course, entry, file_num, videos):
+    ''' Name the file of a link after the last part of its url '''
+    return getWeekDir(course, entry) + '/' + "%02d" % file_num + '_' + getURLFilename(entry['url'])
+
+def getURLFilename(url):
+    ''' RETURNS: the last part of url (where the source filename is), unescaped, spaces and slashes as '_' '''
+    filename = unquote(url[ url.rfind('/') + 1: ])
+    for char in ' /\\':
+        filename = filename.replace(char, '_')
+    return filename
+
+def getVideoFile(course, entry, file_num, videos):
+    ''' Name the file of a video after the course and the video id in its url '''
+    # We need to create an 'x.mp4' filename from the url of the form
+    #    'https://view.vzaar.com/2088434/download':
+    url = entry['url']
+
+    # Let's strip of the /download at the end:
+    urlUptoNumber = url [ :url.find('/download') ]
+
+    # Get the filename from the url after the last slash (where the number is):
+    filename = course.course_id + '_' + urlUptoNumber[ urlUptoNumber.rfind('/') + 1: ] + ".mp4"
+
+    return getWeekDir(course, entry) + '/' + "%02d" % file_num + '_' + filename
+
+def getSubtitleFile(course, entry, file_num, videos):
+    ''' Name the srt file of subtitles after the video they caption, and their language if several are selected '''
+    languages = course.client.languages
+    video = entry['video']
+    if video in videos:
+        ofile = videos[video][:-len('.mp4')]
+    elif video:
+        video_id = video[ :video.find('/download') ]
+        ofile = getWeekDir(course, entry) + '/' + "%02d" % file_num + '_' + course.course_id + '_' + video_id[ video_id.rfind('/') + 1: ]
+    else:
+        filename = getURLFilename(entry['url'])
+        ofile = getWeekDir(course, entry) + '/' + "%02d" % file_num + '_' + filename[:-len('.vtt')]
+
+    if len(languages) > 1 or languages == ['all']:
+        ofile += '.' + entry['lang']
+    return ofile + '.srt'
+
+YOUTUBE_REGC = re.compile(r'(?:youtube(?:-nocookie)?\.com/(?:embed/|watch\?v=)|youtu\.be/)([\w-]{11})')
+
+def getYouTubeURL(url):
+    ''' RETURNS: the watch url of a YouTube video url, or '' '''
+    match = YOUTUBE_REGC.search(url)
+    return 'https://www.youtube.com/watch?v=' + match.group(1) if match else ''
+
+def getShortcutFile(course, entry, file_num, videos):
+    return getWeekDir(course, entry) + '/' + "%02d" % file_num + '_youtube_' + entry['url'][-11:] + '.url'
+
+def saveShortcut(client, entry):
+    ''' Save an internet shortcut to an external video, which isn't downloaded '''
+    if os.path.exists(entry['file']):
+        return { 'size': os.path.getsize(entry['file']), 'etag': None, 'sha256': None }
+
+    content = '[InternetShortcut]\nURL={}\n'.format(entry['url']).encode('utf8')
+    writeFileAtomic(entry['file'], content)
+    return { 'size': len(content), 'etag': None, 'sha256': hashlib.sha256(content).hexdigest() }
+
+for name in [ 'pdf', 'doc', 'docx', 'ppt', 'pptx', 'xls', 'xlsx', 'odt', 'epub', 'txt', 'csv', 'zip' ]:
+    registerAssetType(AssetType(name, description='linked .{} documents'.format(name)))
+for name in [ 'mp3', 'm4a', 'ogg', 'wav' ]:
+    registerAssetType(AssetType(name, ('link', 'audio'), description='linked or embedded .{} audio'.format(name)))
+for name in [ 'jpg', 'jpeg', 'png', 'gif', 'svg' ]:
+    registerAssetType(AssetType(name, ('link', 'image'), description='linked or embedded .{} images'.format(name)))
+registerAssetType(AssetType('wmv', description='linked .wmv videos'))
+registerAssetType(AssetType('mp4', ('video',), normalise=lambda url: url, filename=getVideoFile,
+                            description='step videos, as <course_id>_<video id>.mp4'))
+registerAssetType(AssetType('vtt', ('track',), filename=getSubtitleFile, postprocess=convertVTTLines, numbered=False,
+                            description='video subtitles, converted to srt and named after their video'))
+registerAssetType(AssetType('youtube', ('embed', 'link'), normalise=getYouTubeURL, filename=getShortcutFile, fetch=saveShortcut,
+                            description='embedded YouTube videos, saved as .url shortcuts'))
+
+## -- Page parsers: -------------------------------------------------
+
+WEEK_REGC = re.compile(r"\/todo\/(.*)\"\>\<div")
+STEP_REGC = re.compile(r"\/steps\/(.*)\"\>\<span\>")
+
+def parseCoursePage(content):
+    ''' RETURNS: the list of week ids linked from the course todo page '''
+    ## TODO: Make this page parsing more robust: should be checking /todo/ is part of an "<a href"
+    return WEEK_REGC.findall(content)
+
+def parseCourseWeekPage(content):
+    ''' RETURNS: the list of step ids linked from a course week page '''
+    return STEP_REGC.findall(content)
+
+STEP_ARTICLE_REGC = re.compile(r'<article\b[^>]*>(.*?)</article>', re.S | re.I)
+STEP_TITLE_REGC   = re.compile(r'<h1\b[^>]*>(.*?)</h1>', re.S | re.I)
+STEP_SCRIPT_REGC  = re.compile(r'<(script|style|noscript)\b.*?</\1\s*>', re.S | re.I)
+STEP_BREAK_REGC   = re.compile(r'<(?:br|/p|/div|/li|/h\d|/tr|/blockquote)\b[^>]*>', re.I)
+TAG_REGC          = re.compile(r'<[^>]*>')
+
+def getStepText(content):
+    '''
+       Extract the text of the article of a step page
+
+       RETURNS: title, text (one line per paragraph)
+    '''
+    match = STEP_ARTICLE_REGC.search(content)
+    article = match.group(1) if match else content
+    match = STEP_TITLE_REGC.search(article)
+    title = html.unescape(TAG_REGC.sub('', match.group(1))).strip() if match else ''
+
+    article = STEP_BREAK_REGC.sub('\n', STEP_SCRIPT_REGC.sub('', article))
+    lines = [ ' '.join(html.unescape(line).split()) for line in TAG_REGC.sub('', article).split('\n') ]
+    return title, '\n'.join([ line for line in lines if line ])
+
+def readCourseList(file):
+    '''
+       Read a batch file of courses, one '<course_id> <course_run> [<week_num>]' per line,
+       ignoring blank lines and '#' comments
+
+       RETURNS: list of (course_id, course_run, week_num)
+       RAISES: ValueError if a line isn't of this form
+    '''
+    courses = []
+    with open(file, 'r') as f:
+        for line in f:
+            fields = line.split('#')[0].split()
+            if len(fields) == 0:
+                continue
+            if len(fields) < 2:
+                raise ValueError("expected '<course_id> <course_run> [<week_num>]' in <{}>".format(line.strip()))
+            week_num = int(fields[2]) if len(fields) > 2 else -1
+            courses.append( (fields[0], int(fields[1]), week_num) )
+
+    return courses
+
+## -- Client: -------------------------------------------------------
+
+class FutureLearnClient:
+    '''
+       A login session on the site, with the state shared by all of the courses downloaded
+       through it: the page cache, the per-host rate limiters, the download queue and
+       workers, the database of downloaded assets and the report of failures.
+       Nothing is requested until login() or a course method is called.
+    '''
+    def __init__(self, base_url=BASE_URL, op_dir='.', cache_dir=None, cookie_dir=None, tmp_dir=None,
+                 workers=WORKERS, crawl_workers=CRAWL_WORKERS,
+                 download_types=DOWNLOAD_TYPES, languages=SUBTITLE_LANGUAGES,
+                 quality=QUALITY, course_quality={}, time_budget=TIME_BUDGET, byte_budget=BYTE_BUDGET,
+                 schedule=SCHEDULE, max_rate=MAX_RATE, windows=WINDOWS, host_rate=HOST_RATE, host_burst=HOST_BURST):
+        self.base_url = base_url
+        self.signin_url = base_url + '/sign-in'
+        # Scheme used for "//host/path" urls found in pages:
+        self.url_scheme = urlparse(base_url).scheme + ':'
+
+        self.op_dir = op_dir
+        self.cache_dir = cache_dir if PAGE_CACHE else None
+        self.cookie_dir = cookie_dir
+        self.tmp_dir = tmp_dir
+        self.workers = workers
+        self.crawl_workers = crawl_workers
+        self.download_types = [ DOWNLOAD_TYPE.lower() for DOWNLOAD_TYPE in download_types ]
+        self.languages = languages
+        self.quality = quality
+        self.course_quality = dict(course_quality)
+        self.time_budget = time_budget
+        self.byte_budget = byte_budget
+        self.schedule = schedule
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        # Per-chunk cap of the download throughput, with bursts of a second:
+        max_rate = parseBytes(max_rate)
+        self.bandwidth = TokenBucket(max_rate, max(max_rate, DOWNLOAD_CHUNK_SIZE)) if max_rate else None
+        self.windows = parseWindows(windows)
+
+        self.session = createSession(workers + crawl_workers)
+        self.cookie_file = None
+
+        self.failures = []
+        self.failures_lock = threading.Lock()
+        self.host_buckets = {}
+        self.host_buckets_lock = threading.Lock()
+        self.download_queue = queue.PriorityQueue()
+        self.download_sequence = itertools.count()
+        self.download_workers = []
+        self.manifest_db = None
+        self.manifest_db_lock = threading.Lock()
+        self.store = None
+        self.journal = None
+        self.archive = None
+        self.job_queue = None
+        self.lease_renewer = None
+        self.downloads_start = None
+        self.pending_videos = 0
+        self.pending_videos_lock = threading.Lock()
+
+    def course(self, course_id, course_run):
+        ''' RETURNS: a CourseDownloader of the course run, sharing this client '''
+        return CourseDownloader(self, course_id, course_run, self.course_quality.get(course_id, self.quality))
+
+    def close(self):
+        ''' Release the session and the database '''
+        self.session.close()
+        if self.manifest_db is not None:
+            self.manifest_db.close()
+            self.manifest_db = None
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+        if self.job_queue is not None:
+            self.job_queue.close()
+            self.job_queue = None
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+    def saveItem(self, file, item, content):
+        if not self.tmp_dir:
+            return None
+        ofile= self.tmp_dir + '/' + file
+        debug(2, "Writing {} to <{}>".format(item, ofile))
+        writeFile(ofile, content)
+        return ofile
+
+    def saveDebugItem(self, file, item, content):
+        if DEBUG:
+            return self.saveItem(file, item, content)
+
+    ## -- Login: ----------------------------------------------------
+
+    def getToken(self):
+        ''' Perform request to the signin url and extract the 'authenticity_token'
+            RETURN: token and cookies
+            RAISES: RequestFailed if the sign-in page has no token
+        '''
+        response = self.httpRequest('GET', self.signin_url, headers=headers)
+        #showResponse(response)
+        content = response.content.decode('utf8')
+        self.saveDebugItem('token.response.content', "'getToken' response", content)
+
+        apos = content.find("authenticity_token")
+        if apos == -1:
+            raise RequestFailed(self.signin_url, 'no authenticity_token in the sign-in page', False)
+
+        vpos = content[ apos: ].find("value=")
+
+        if vpos == -1:
+            raise RequestFailed(self.signin_url, 'no value in the authenticity_token of the sign-in page', False)
+
+        token_pos = apos + vpos + len("value=") + 1
+        close_quote_pos = token_pos + content[token_pos:].find('"')
+
+        debug(2, "authenticity_token at pos {} -> {} in response.content".format(token_pos, close_quote_pos))
+
+        token=content[ token_pos: close_quote_pos ]
+        debug(4, "Got authenticity_token '{}' [len {}]".format(token, len(token)))
+
+        if len(token) < 88:
+            raise RequestFailed(self.signin_url, 'authenticity_token too short', False)
+
+        return token, response.cookies
+
+    def signIn(self, email, password, token, cookies):
+        ''' Perform request to the signin url to perform site login
+            RETURN: response
+        '''
+        data=json.dumps({'email': email, 'password':password, 'authenticity_token':token})
+        debug(4, "COOKIES={}".format( str(cookies) ))
+
+        response = self.httpRequest('POST', self.signin_url, headers=headers, cookies=cookies, data=data)
+        content = response.content.decode('utf8')
+        self.saveDebugItem('login.response.content', "'login' response", content)
+
+        return response
+
+    def login(self, email, password, check_url=None):
+        '''
+           Log in as email, unless the cookies kept from a previous login are still valid:
+           check_url must be a page which is only returned to logged in users
+
+           RAISES: RequestFailed if the sign-in page can't be fetched or has no token
+        '''
+        self.cookie_file = self.getCookieFile(email)
+        with timed('login'):
+            if self.cookie_file and self.loadCookies(self.cookie_file) and check_url and self.isLoggedIn(check_url):
+                debug(1, "Reusing the login session of <{}>".format(self.cookie_file))
+                return
+
+            token, cookies = self.getToken()
+            self.signIn(email, password, token, cookies)
+            if self.cookie_file:
+                self.saveCookies()
+
+    def getCookieFile(self, email):
+        ''' RETURNS: the cookie jar file of the account email, or None if cookies aren't kept '''
+        if not self.cookie_dir:
+            return None
+        return self.cookie_dir + '/cookies.' + hashlib.sha1(email.encode('utf8')).hexdigest()[:12] + '.txt'
+
+    def loadCookies(self, cookie_file):
+        '''
+           Use the cookie jar cookie_file for the session, loading any cookies of a previous run
+
+           RETURNS: True if cookies were loaded
+        '''
+        self.session.cookies = http.cookiejar.LWPCookieJar(cookie_file)
+        if not os.path.exists(cookie_file):
+            return False
+
+        try:
+            self.session.cookies.load(ignore_discard=True)
+        except (http.cookiejar.LoadError, OSError) as exc:
+            print("ERROR: Ignoring unreadable cookie file <{}> - {}".format(cookie_file, str(exc)))
+            return False
+
+        debug(2, "Loaded {} cookies from <{}>".format(len(self.session.cookies), cookie_file))
+        return len(self.session.cookies) > 0
+
+    def saveCookies(self):
+        ''' Save the session cookies, readable by the owner only '''
+        cookie_file = self.session.cookies.filename
+        # Only a directory created here is restricted: FL_COOKIE_DIR may be a shared one
+        if not os.path.isdir(os.path.dirname(cookie_file)):
+            os.makedirs(os.path.dirname(cookie_file), mode=0o700)
+
+        # Create the file with restricted permissions before any cookie is written to it:
+        os.close(os.open(cookie_file, os.O_WRONLY | os.O_CREAT, 0o600))
+        os.chmod(cookie_file, 0o600)
+        self.session.cookies.save(ignore_discard=True)
+        debug(2, "Saved {} cookies to <{}>".format(len(self.session.cookies), cookie_file))
+
+    def isLoggedIn(self, url):
+        '''
+           Check with a single request that the session is still logged in: url must be a page
+           which is only returned to logged in users (others are redirected to sign-in)
+
+           RETURNS: True if logged in
+        '''
+        response = self.httpRequest('GET', url, headers=headers, allow_redirects=False)
+        response.close()
+        debug(2, "Login check of <{}> => {}".format(url, response.status_code))
+        return response.status_code == 200
+
+    ## -- HTTP requests: --------------------------------------------
+
+    def recordFailure(self, url, reason, retryable, context):
+        ''' Add a failure to the report of this run '''
+        print("ERROR: {} failed: {} <{}>".format(context, reason, url))
+        countMetric('failures')
+        failure = { 'url': url, 'reason': reason, 'retryable': retryable, 'context': context }
+        with self.failures_lock:
+            self.failures.append(failure)
+        return failure
+
+    def writeFailureReport(self, file):
+        '''
+           Print a summary of the failures of this run, and save them as json to file
+
+           RETURNS: the number of failures
+        '''
+        failures = self.failures
+        if len(failures) == 0:
+            if os.path.exists(file):
+                os.remove(file)
+            return 0
+
+        retryable = len([ failure for failure in failures if failure['retryable'] ])
+        print("-- {} failure(s): {} retryable, {} permanent -----------".format(len(failures), retryable, len(failures) - retryable))
+        for failure in failures:
+            print("{:<10} {} - {} <{}>".format('retryable' if failure['retryable'] else 'permanent',
+                                              failure['context'], failure['reason'], failure['url']))
+
+        writeFile(file, json.dumps(failures, indent=1))
+        print("Failure report written to <{}>".format(file))
+        return len(failures)
+
+    def httpRequest(self, method, url, throttled=False, **kwargs):
+        '''
+           Perform a request through the shared session, retrying network errors and
+           RETRYABLE_STATUS responses with exponential backoff and jitter, or after the
+           Retry-After delay, which also holds back the other downloads from that host.
+           If throttled, each attempt first waits for the politeness limit of the host
+
+           RETURNS: the response, whose status isn't retryable
+           RAISES: RequestFailed once HTTP_RETRIES attempts have failed
+        '''
+        kwargs.setdefault('timeout', DOWNLOAD_TIMEOUT)
+
+        for attempt in range(1, HTTP_RETRIES+1):
+            if throttled:
+                self.throttle(url)
+
+            wait = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exc:
+                reason = exc.__class__.__name__
+            else:
+                if not response.status_code in RETRYABLE_STATUS:
+                    return response
+                reason = 'HTTP {}'.format(response.status_code)
+                wait = getRetryAfter(response)
+                response.close()
+                if wait:
+                    self.getHostBucket(url).hold(wait)
+
+            if attempt == HTTP_RETRIES:
+                break
+            if wait is None:
+                wait = min(BACKOFF_MAX, BACKOFF * 2 ** (attempt-1)) * random.uniform(0.5, 1.5)
+            debug(1, "{} for <{}>, retrying in {:.1f}s [attempt {}]".format(reason, url, wait, attempt+1))
+            countMetric('http_retries')
+            sleep(wait)
+
+        raise RequestFailed(url, reason, True)
+
+    def getHostBucket(self, url):
+        ''' RETURNS: the rate limiter of the host serving url '''
+        host = urlparse(url).netloc
+        with self.host_buckets_lock:
+            if not host in self.host_buckets:
+                self.host_buckets[host] = TokenBucket(self.host_rate, self.host_burst)
+            return self.host_buckets[host]
+
+    def throttle(self, url):
+        ''' Wait for the politeness limit of the host serving url '''
+        debug(4, "Waiting for rate limit of host <{}>".format(urlparse(url).netloc))
+        self.getHostBucket(url).acquire()
+
+    ## -- Page cache: -----------------------------------------------
+
+    def getCacheFiles(self, url):
+        ''' RETURNS: the metadata and body files caching url '''
+        key = hashlib.sha1(url.encode('utf8')).hexdigest()
+        return self.cache_dir + '/' + key + '.json', self.cache_dir + '/' + key + '.body'
+
+    def getPage(self, url):
+        '''
+           GET a page through the on-disk page cache.
+           Fresh cached pages are returned without any request, stale ones are revalidated
+           using their ETag/Last-Modified validators
+
+           RETURNS: status_code, decoded content
+           RAISES: RequestFailed if the page couldn't be fetched
+        '''
+        with timed('page_fetch'):
+            return self.getCachedPage(url)
+
+    def getCachedPage(self, url):
+        if not self.cache_dir:
+            countMetric('cache_misses')
+            response = self.httpRequest('GET', url, headers=headers)
+            return response.status_code, response.content.decode('utf8', 'ignore')
+
+        meta_file, body_file = self.getCacheFiles(url)
+        meta = None
+        if os.path.exists(meta_file) and os.path.exists(body_file):
+            with open(meta_file, 'r') as f:
+                meta = json.load(f)
+
+        req_headers = dict(headers)
+        if meta:
+            if time() - meta['fetched'] < CACHE_TTL:
+                debug(2, "Page cache hit for <{}>".format(url))
+                countMetric('cache_hits')
+                os.utime(meta_file)
+                with open(body_file, 'rb') as f:
+                    return 200, f.read().decode('utf8', 'ignore')
+
+            if meta.get('etag'):
+                req_headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                req_headers['If-Modified-Since'] = meta['last_modified']
+
+        response = self.httpRequest('GET', url, headers=req_headers)
+
+        if response.status_code == 304 and meta:
+            debug(2, "Page cache revalidated <{}>".format(url))
+            countMetric('cache_revalidated')
+            meta['fetched'] = time()
+            writeFileAtomic(meta_file, json.dumps(meta).encode('utf8'))
+            with open(body_file, 'rb') as f:
+                return 200, f.read().decode('utf8', 'ignore')
+
+        countMetric('cache_misses')
+        # A page reached through a redirect (as the sign-in page is, when logged out) isn't url's page:
+        if response.status_code == 200 and not response.history and response.url == url:
+            meta = { 'url': url, 'fetched': time(),
+                     'etag': response.headers.get('ETag'),
+                     'last_modified': response.headers.get('Last-Modified') }
+            writeFileAtomic(body_file, response.content)
+            writeFileAtomic(meta_file, json.dumps(meta).encode('utf8'))
+
+        return response.status_code, response.content.decode('utf8', 'ignore')
+
+    def evictCache(self):
+        ''' Remove the least recently used pages until the cache fits in CACHE_SIZE bytes '''
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            meta_file = self.cache_dir + '/' + name
+            body_file = meta_file[:-len('.json')] + '.body'
+            size = os.path.getsize(meta_file)
+            if os.path.exists(body_file):
+                size += os.path.getsize(body_file)
+            entries.append( (os.path.getmtime(meta_file), size, meta_file, body_file) )
+            total += size
+
+        entries.sort()
+        for mtime, size, meta_file, body_file in entries:
+            if total <= CACHE_SIZE:
+                break
+            debug(2, "Evicting <{}> from page cache".format(meta_file))
+            for file in (meta_file, body_file):
+                if os.path.exists(file):
+                    os.remove(file)
+            total -= size
+
+    ## -- Downloads: ------------------------------------------------
+
+    def downloadURLToFile(self, url, file, DOWNLOAD_TYPE, size=None, replace=False):
+        '''
+            Stream url to file, unless file already exists (with the size recorded for it, if
+            known, and a valid content for its type) and isn't to be replaced.
+            Interrupted downloads are retried up to DOWNLOAD_RETRIES times, resuming from the
+            end of the '.part' file
+
+            RETURNS: dict of the size, etag and sha256 of the file, or None if nothing was saved
+        '''
+        if not(OVERWRITE_NONEMPTY_FILES) and not replace and os.path.exists(file):
+            statinfo = os.stat(file)
+            if statinfo.st_size != 0 and isCompleteFile(file, DOWNLOAD_TYPE, size):
+                debug(2, "Skipping non-zero size file <{}> of {} bytes".format(file, statinfo.st_size))
+                return { 'size': statinfo.st_size, 'etag': None, 'sha256': None }
+            if statinfo.st_size != 0:
+                print("Replacing truncated or invalid file <{}>".format(file))
+                countMetric('files_invalid')
+                os.remove(file)
+
+        debug(1, "Downloading url<{}> ...".format(url))
+
+        attempt = 1
+        while True:
+            try:
+                return self.downloadPartFile(url, file, DOWNLOAD_TYPE)
+            except TransferPaused:
+                # Not a failure: resumed from the '.part' file once a window opens
+                debug(1, "Download of <{}> paused at the end of its time window".format(url))
+                countMetric('transfer_pauses')
+                self.waitForWindow()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError, IncompleteDownload) as exc:
+                if attempt == DOWNLOAD_RETRIES:
+                    raise
+                debug(1, "Download of <{}> interrupted ({}), resuming [attempt {}]".format(url, str(exc), attempt+1))
+                countMetric('download_resumes')
+                sleep(2 ** attempt)
+                attempt += 1
+
+    def downloadPartFile(self, url, file, DOWNLOAD_TYPE):
+        '''
+            Download url into file + '.part', using a Range request to continue a previous
+            partial download if its ETag and Content-Length still match.
+            The part file is renamed to file once complete
+
+            RETURNS: dict of the size, etag and sha256 of the file, or None if nothing was saved
+        '''
+        partfile = file + '.part'
+        part_info = readPartInfo(partfile)
+
+        # No user-agent: had some failures in this case when specifying user-agent ...
+        headers = { }
+
+        offset = 0
+        if part_info:
+            offset = os.path.getsize(partfile)
+            headers['Range'] = 'bytes={}-'.format(offset)
+            if part_info['etag']:
+                headers['If-Range'] = part_info['etag']
+            debug(2, "Resuming <{}> at byte {}".format(partfile, offset))
+
+        response = self.httpRequest('GET', url, throttled=True, headers=headers, stream=True)
+        try:
+            #showResponse(response)
+            checkResponse(response, (200, 206, 416))
+            if response.status_code == 416 and part_info and offset == part_info['length']:
+                debug(2, "Part file <{}> was already complete".format(partfile))
+                length = offset
+            elif response.status_code == 416:
+                removePartFile(partfile)
+                raise IncompleteDownload("range of <{}> not satisfiable".format(partfile))
+            elif response.status_code == 206:
+                # Content-Range: bytes <start>-<end>/<length>
+                content_range = response.headers.get('content-range', '')
+                match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', content_range)
+                if not match or int(match.group(1)) != offset or match.group(2) != str(part_info['length']):
+                    removePartFile(partfile)
+                    raise IncompleteDownload("unexpected Content-Range '{}'".format(content_range))
+                length = part_info['length']
+            else:
+                # Full content: the server ignored the Range or the file changed, start again
+                offset = 0
+                length = response.headers.get('content-length')
+                if length is not None:
+                    length = int(length)
+
+            debug(1, "type={}, content.len={}".format(DOWNLOAD_TYPE, length if length is not None else '?'))
+
+            sha256 = hashlib.sha256()
+            chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+            if offset == 0:
+                head = b''
+                for chunk in chunks:
+                    head += chunk
+                    if len(head) >= SNIFF_SIZE:
+                        break
+
+                if isBadContent(response, head):
+                    print("Skipping bad content for file <{}> - may not be available yet".format(file))
+                    removePartFile(partfile)
+                    return None
+                if not getAssetType(DOWNLOAD_TYPE).isValidContent(head):
+                    removePartFile(partfile)
+                    countMetric('files_invalid')
+                    raise RequestFailed(url, 'not a {} file (Content-Type {}, starting with {})'.format(
+                                        DOWNLOAD_TYPE, response.headers.get('content-type'), head[:16]), True)
+
+                etag = response.headers.get('ETag')
+                with open(partfile + '.json', 'w') as f:
+                    json.dump({ 'url': url, 'etag': etag, 'length': length }, f)
+                f = open(partfile, 'wb')
+                f.write(head)
+                sha256.update(head)
+                countMetric('bytes_downloaded', len(head))
+                self.throttleTransfer(len(head), f)
+            else:
+                etag = part_info['etag']
+                with open(partfile, 'rb') as f:
+                    for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                        sha256.update(chunk)
+                f = open(partfile, 'ab')
+
+            debug(2, "Writing content to <{}>".format(partfile))
+            try:
+                if response.status_code == 206 or offset == 0:
+                    for chunk in chunks:
+                        sha256.update(chunk)
+                        f.write(chunk)
+                        countMetric('bytes_downloaded', len(chunk))
+                        self.throttleTransfer(len(chunk), f)
+            finally:
+                f.close()
+
+            nbytes = os.path.getsize(partfile)
+            if length is not None and nbytes != length:
+                raise IncompleteDownload("got {} of {} bytes".format(nbytes, length))
+
+            os.replace(partfile, file)
+            os.remove(partfile + '.json')
+            debug(2, "Wrote {} bytes to <{}>".format(nbytes, file))
+            return { 'size': nbytes, 'etag': etag, 'sha256': sha256.hexdigest() }
+        finally:
+            response.close()
+        #fatal("STOP")
+
+    def iterTransfer(self, response):
+        ''' RETURNS: generator of the chunks of the body of response, counted and capped as downloaded bytes '''
+        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            countMetric('bytes_downloaded', len(chunk))
+            if self.bandwidth:
+                self.bandwidth.acquire(len(chunk))
+            yield chunk
+
+    def throttleTransfer(self, nbytes, f):
+        '''
+           Wait for the bandwidth cap after nbytes were written to the file f of a transfer
+
+           RAISES: TransferPaused (f being closed) if the time window of the transfer has ended
+        '''
+        if self.windows and not isInWindows(self.windows, datetime.now()):
+            f.close()
+            raise TransferPaused()
+        if self.bandwidth:
+            self.bandwidth.acquire(nbytes)
+
+    def waitForWindow(self):
+        ''' Wait until downloads are allowed by the time windows '''
+        wait = getWindowWait(self.windows) if self.windows else 0
+        if wait:
+            debug(1, "Outside of the download time windows, pausing {:.0f}s".format(wait))
+            countMetric('window_waits')
+        while wait:
+            sleep(min(wait, 60))
+            wait = getWindowWait(self.windows)
+
+    def downloadConverted(self, url, file, convert, replace=False):
+        '''
+            Stream the text at url straight into file, converting its lines on the fly with
+            the generator convert (e.g. vtt subtitles to srt), unless file already exists and
+            isn't to be replaced
+
+            RETURNS: dict of the size, etag and sha256 of the srt file, or None if nothing was saved
+        '''
+        if not(OVERWRITE_NONEMPTY_FILES) and not replace and os.path.exists(file) and os.path.getsize(file) != 0:
+            debug(2, "Skipping non-zero size file <{}>".format(file))
+            return { 'size': os.path.getsize(file), 'etag': None, 'sha256': None }
+
+        debug(1, "Downloading url<{}> ...".format(url))
+
+        for attempt in range(1, DOWNLOAD_RETRIES+1):
+            response = self.httpRequest('GET', url, throttled=True, stream=True)
+            try:
+                checkResponse(response)
+                # Not iter_lines(), which yields an empty line (ending a subtitle cue) for a
+                # CRLF split between two chunks:
+                content = ''.join(convert(iterTextLines(self.iterTransfer(response)))).encode('utf8')
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as exc:
+                if attempt == DOWNLOAD_RETRIES:
+                    raise
+                debug(1, "Download of <{}> interrupted ({}), retrying [attempt {}]".format(url, str(exc), attempt+1))
+                countMetric('download_resumes')
+                sleep(2 ** attempt)
+            finally:
+                response.close()
+
+        writeFileAtomic(file, content)
+        debug(2, "Wrote {} bytes to <{}>".format(len(content), file))
+        return { 'size': len(content), 'etag': response.headers.get('ETag'), 'sha256': hashlib.sha256(content).hexdigest() }
+
+    ## -- Download manifest database: -------------------------------
+
+    def openManifestDB(self, db_file):
+        ''' Open (creating if needed) the database of downloaded assets '''
+        debug(2, "Using manifest db <{}>".format(db_file))
+        self.manifest_db = sqlite3.connect(db_file, check_same_thread=False, timeout=60)
+        self.manifest_db.execute('''CREATE TABLE IF NOT EXISTS assets (
+                                      course_id TEXT, course_run INTEGER, url TEXT,
+                                      week_num INTEGER, step_id TEXT, type TEXT, file TEXT,
+                                      size INTEGER, etag TEXT, sha256 TEXT, updated REAL,
+                                      PRIMARY KEY (course_id, course_run, url) )''')
+        self.manifest_db.commit()
+
+    def openJournal(self, journal_file, resume=False):
+        '''
+           Journal this run to journal_file, or resume the run it journaled
+
+           RETURNS: the 'run' event of the journaled run when resuming, else None
+        '''
+        self.journal = RunJournal(journal_file)
+        if resume and not self.journal.load():
+            print("No interrupted run to resume in <{}>".format(journal_file))
+            resume = False
+        self.journal.open(resume)
+        return self.journal.run if resume else None
+
+    def openArchive(self, archive_file):
+        '''
+           Archive the text of the step pages in archive_file
+
+           RAISES: sqlite3.OperationalError if sqlite has no FTS5 full-text index
+        '''
+        debug(2, "Using step archive <{}>".format(archive_file))
+        self.archive = StepArchive(archive_file)
+
+    def openJobQueue(self, queue_file):
+        ''' Share the download jobs with other worker processes through the job queue queue_file '''
+        debug(2, "Using job queue <{}>".format(queue_file))
+        self.job_queue = JobQueue(queue_file)
+
+    def openStore(self, store_dir):
+        ''' Keep downloaded files in the blob store store_dir, shared with other courses and runs '''
+        debug(2, "Using blob store <{}>".format(store_dir))
+        self.store = BlobStore(store_dir)
+
+    def recordAsset(self, entry, info):
+        ''' Record a downloaded (or already present) manifest entry in the database '''
+        if self.manifest_db is None:
+            return
+
+        with self.manifest_db_lock:
+            self.manifest_db.execute('''INSERT INTO assets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                        ON CONFLICT (course_id, course_run, url) DO UPDATE SET
+                                          week_num=excluded.week_num, step_id=excluded.step_id,
+                                          type=excluded.type, file=excluded.file, size=excluded.size,
+                                          etag=COALESCE(excluded.etag, etag),
+                                          sha256=COALESCE(excluded.sha256, sha256),
+                                          updated=excluded.updated''',
+                                     (entry['course_id'], entry['course_run'], entry['url'], entry['week_num'],
+                                      entry['step_id'], entry['type'], entry['file'],
+                                      info['size'], info['etag'], info['sha256'], time()))
+            self.manifest_db.commit()
+
+    def getKnownAsset(self, entry):
+        ''' RETURNS: the database row of the asset of a manifest entry if its file was recorded, else None '''
+        if self.manifest_db is None:
+            return None
+        with self.manifest_db_lock:
+            self.manifest_db.row_factory = sqlite3.Row
+            row = self.manifest_db.execute('SELECT * FROM assets WHERE course_id=? AND course_run=? AND url=? AND file=?',
+                                           (entry['course_id'], entry['course_run'], entry['url'], entry['file'])).fetchone()
+            self.manifest_db.row_factory = None
+        return row
+
+    def getStepFiles(self, course_id, course_run, step_id):
+        ''' RETURNS: the recorded files of the assets of a step '''
+        with self.manifest_db_lock:
+            rows = self.manifest_db.execute('SELECT file FROM assets WHERE course_id=? AND course_run=? AND step_id=? ORDER BY file',
+                                            (course_id, course_run, step_id)).fetchall()
+        return [ row[0] for row in rows ]
+
+    def getAllAssets(self):
+        ''' RETURNS: the database rows of all the recorded assets, as dicts '''
+        with self.manifest_db_lock:
+            self.manifest_db.row_factory = sqlite3.Row
+            rows = self.manifest_db.execute('SELECT * FROM assets ORDER BY course_id, course_run, file').fetchall()
+            self.manifest_db.row_factory = None
+        return [ dict(row) for row in rows ]
+
+    def writeChecksumManifest(self, course_id):
+        '''
+           Write the sha256 of the recorded files of course_id to <course dir>/SHA256SUMS, as
+           'sha256sum -c' checks them
+        '''
+        course_dir = self.op_dir + '/' + course_id
+        with self.manifest_db_lock:
+            rows = self.manifest_db.execute('SELECT file, sha256 FROM assets WHERE course_id=? AND sha256 IS NOT NULL ORDER BY file',
+                                            (course_id,)).fetchall()
+        lines = [ '{}  {}\n'.format(sha256, os.path.relpath(file, course_dir)) for file, sha256 in rows if os.path.exists(file) ]
+        if lines:
+            writeFileAtomic(course_dir + '/SHA256SUMS', ''.join(lines).encode('utf8'))
+
+    def getKnownAssets(self, course_id, course_run):
+        ''' RETURNS: dict of url -> database row for the assets of a course run '''
+        with self.manifest_db_lock:
+            self.manifest_db.row_factory = sqlite3.Row
+            rows = self.manifest_db.execute('SELECT * FROM assets WHERE course_id=? AND course_run=?',
+                                            (course_id, course_run)).fetchall()
+            self.manifest_db.row_factory = None
+
+        return { row['url']: row for row in rows }
+
+    ## -- Video quality: --------------------------------------------
+
+    def getVideoRenditions(self, entry):
+        ''' RETURNS: the urls of the renditions of entry acceptable under its quality policy, preferred first '''
+        if entry.get('sd_url') is None:
+            return [ entry['url'] ]
+
+        quality = entry.get('quality', self.quality)
+        if quality == 'hd':
+            return [ entry['url'] ]
+        if quality == 'sd':
+            return [ entry['sd_url'] ]
+        if quality == 'smallest':
+            return [ entry['sd_url'], entry['url'] ]
+        return [ entry['url'], entry['sd_url'] ]
+
+    def chooseVideoURL(self, entry):
+        '''
+           Choose the rendition of a video to download according to its quality policy
+           (see QUALITY_MODES): entry['url'] is the HD one if the video has one, with the
+           SD one in entry['sd_url']
+
+           RETURNS: the url to download
+        '''
+        hd_url = entry['url']
+        sd_url = entry.get('sd_url')
+        quality = entry.get('quality', self.quality)
+        if sd_url is None or quality == 'hd':
+            return hd_url
+        if quality == 'sd':
+            return sd_url
+
+        if quality in ('best', 'smallest'):
+            hd_size = self.getContentLength(hd_url)
+            sd_size = self.getContentLength(sd_url)
+            debug(2, "Video <{}>: HD {} bytes, SD {} bytes".format(hd_url, hd_size, sd_size))
+            if hd_size is None or sd_size is None:
+                return hd_url if quality == 'best' else sd_url
+            if quality == 'best':
+                return hd_url if hd_size >= sd_size else sd_url
+            return sd_url if sd_size <= hd_size else hd_url
+
+        # auto:
+        if self.isOverBudget(hd_url):
+            debug(1, "Downloading SD rendition of <{}> to stay within budget".format(hd_url))
+            countMetric('quality_downgrades')
+            return sd_url
+        return hd_url
+
+    def getContentLength(self, url):
+        ''' RETURNS: the Content-Length of url from a HEAD request, or None if unknown '''
+        response = self.httpRequest('HEAD', url, throttled=True, allow_redirects=True)
+        response.close()
+        length = response.headers.get('content-length', '')
+        if response.status_code != 200 or not length.isdigit():
+            return None
+        return int(length)
+
+    def isChangedAsset(self, entry, etag):
+        '''
+           Revalidate the recorded asset of a manifest entry, downloaded with the ETag etag, by a
+           conditional HEAD request (If-None-Match) of each of its acceptable renditions
+
+           RETURNS: True if the server has a new version of it, False if not or if it can't tell
+        '''
+        changed = False
+        for url in self.getVideoRenditions(entry):
+            try:
+                response = self.httpRequest('HEAD', url, throttled=True, allow_redirects=True,
+                                            headers=dict(headers, **{ 'If-None-Match': etag }))
+            except RequestFailed as exc:
+                debug(1, "Can't revalidate <{}>: {}".format(url, exc.reason))
+                return False
+            response.close()
+            if response.status_code == 304 or response.headers.get('ETag') == etag:
+                return False
+            changed = changed or response.status_code == 200
+        return changed
+
+    def isOverBudget(self, url):
+        '''
+           Project the run as if the video url, and each video still queued, was as large as url,
+           at the download throughput achieved so far
+
+           RETURNS: True if the run would then exceed the time or byte budget
+        '''
+        if not self.time_budget and not self.byte_budget:
+            return False
+        size = self.getContentLength(url)
+        if size is None:
+            return False
+
+        with self.pending_videos_lock:
+            remaining = size * (1 + self.pending_videos)
+        nbytes = getCounter('bytes_downloaded')
+        if self.byte_budget and nbytes + remaining > self.byte_budget:
+            return True
+
+        elapsed = monotonic() - self.downloads_start
+        if self.time_budget and nbytes and elapsed:
+            eta = remaining / (nbytes / elapsed)
+            debug(2, "Run ends in {:.0f}s at HD: {:.0f}s of {:.0f}s budget".format(eta, monotonic() - run_start + eta, self.time_budget))
+            if monotonic() - run_start + eta > self.time_budget:
+                return True
+        return False
+
+    ## -- Download scheduler: ---------------------------------------
+
+    def downloadWorker(self):
+        ''' Drain the download queue until a None job is received '''
+        while True:
+            priority, sequence, job = self.download_queue.get()
+            try:
+                if job is None:
+                    return
+                if job['type'] == 'mp4':
+                    with self.pending_videos_lock:
+                        self.pending_videos -= 1
+                self.waitForWindow()
+                self.downloadEntry(job)
+            finally:
+                self.download_queue.task_done()
+
+    def queueWorker(self, owner):
+        ''' Download the jobs leased from the shared job queue as owner, until the queue is finished '''
+        while True:
+            self.waitForWindow()
+            entry = self.job_queue.lease(owner)
+            if entry is None:
+                if self.job_queue.isFinished():
+                    return
+                sleep(JOB_POLL)
+                continue
+            countMetric('files_queued')
+            self.job_queue.complete(entry, owner, self.downloadEntry(entry))
+
+    def renewLeases(self, stop):
+        ''' Renew the leases of the jobs of this process every third of their duration, until stop is set '''
+        while not stop.wait(self.job_queue.lease_time / 3):
+            self.job_queue.renew(getWorkerName() + ':')
+
+    def downloadEntry(self, entry):
+        '''
+           Download the asset of a manifest entry (or link it from the blob store)
+
+           RETURNS: None, or the failure recorded if it couldn't be downloaded
+        '''
+        try:
+            if self.journal:
+                self.journal.write('started', key=getJobKey(entry))
+            mkdir_p(os.path.dirname(entry['file']))
+
+            info = None
+            if self.store and not os.path.exists(entry['file']):
+                for url in self.getVideoRenditions(entry):
+                    entry['download_url'] = url
+                    info = self.store.fetch(entry)
+                    if info:
+                        break
+            if info:
+                # Already held for another course or run: no request at all
+                countMetric('files_linked')
+                countMetric('store_bytes_saved', info['size'])
+                self.recordAsset(entry, info)
+                self.recordDone(entry)
+                return None
+
+            asset_type = getAssetType(entry['type'])
+            if asset_type.fetch:
+                info = asset_type.fetch(self, entry)
+            elif asset_type.postprocess:
+                with timed(entry['type'] + '_conversion'):
+                    info = self.downloadConverted(entry['url'], entry['file'], asset_type.postprocess, entry.get('changed', False))
+            else:
+                known = self.getKnownAsset(entry)
+                size = known['size'] if known else None
+                # Any file which will be (re)downloaded gets the rendition its quality policy chooses:
+                if entry.get('changed') or not os.path.exists(entry['file']) or not isCompleteFile(entry['file'], entry['type'], size):
+                    entry['download_url'] = self.chooseVideoURL(entry)
+                with timed('download'):
+                    info = self.downloadURLToFile(entry.get('download_url', entry['url']), entry['file'], entry['type'], size,
+                                                  entry.get('changed', False))
+            if info:
+                if self.store:
+                    self.store.add(entry, info)
+                self.recordAsset(entry, info)
+                countMetric('files_skipped' if info['sha256'] is None else 'files_downloaded')
+            self.recordDone(entry)
+        except RequestFailed as exc:
+            return self.recordFailure(exc.url, exc.reason, exc.retryable, entry['file'])
+        except Exception as exc:
+            return self.recordFailure(entry['url'], str(exc), False, entry['file'])
+        return None
+
+    def recordDone(self, entry):
+        if self.journal:
+            self.journal.write('done', key=getJobKey(entry))
+
+    def startDownloadWorkers(self):
+        ''' Start the pool of download worker threads '''
+        debug(2, "Starting {} download workers".format(self.workers))
+        self.downloads_start = monotonic()
+        gaugeMetric('download_workers', self.workers)
+        for i in range(self.workers):
+            if self.job_queue:
+                worker = threading.Thread(target=self.queueWorker, name='download-{}'.format(i), daemon=True,
+                                          args=('{}:{}'.format(getWorkerName(), i),))
+            else:
+                worker = threading.Thread(target=self.downloadWorker, name='download-{}'.format(i), daemon=True)
+            worker.start()
+            self.download_workers.append(worker)
+
+        if self.job_queue:
+            self.lease_renewer = threading.Event()
+            threading.Thread(target=self.renewLeases, name='lease-renewer', daemon=True, args=(self.lease_renewer,)).start()
+
+    def getPriority(self, entry):
+        ''' RETURNS: the priority of the download of a manifest entry by the schedule (lowest first) '''
+        if self.schedule == 'type':
+            for rank in [ entry['type'], '*' ]:
+                if rank in TYPE_PRIORITY:
+                    return TYPE_PRIORITY.index(rank)
+            return len(TYPE_PRIORITY)
+        if self.schedule == 'small':
+            known = self.getKnownAsset(entry)
+            if known:
+                return known['size']
+            asset_type = getAssetType(entry['type'])
+            if asset_type.fetch:
+                return 0
+            return max([ TYPICAL_SIZE.get(source, 0) for source in asset_type.sources ])
+        if self.schedule == 'week':
+            return entry['week_num']
+        return 0
+
+    def queueDownload(self, entry):
+        ''' Queue the download of a manifest entry '''
+        debug(4, "Queueing url<{}> [queue depth {}]".format(entry['url'], self.download_queue.qsize()))
+        if entry['type'] == 'mp4':
+            with self.pending_videos_lock:
+                self.pending_videos += 1
+        self.download_queue.put( (self.getPriority(entry), next(self.download_sequence), entry) )
+        countMetric('files_queued')
+        gaugeMetric('queue_depth', self.download_queue.qsize())
+
+    def downloadFile(self, entry):
+        ''' Queue the download of a manifest entry '''
+        if not DOWNLOAD:
+            return
+        if self.journal and not self.journal.recordQueued(entry):
+            debug(2, "Already queued <{}>".format(entry['url']))
+            return
+
+        debug(1, "Queueing {} <{}>".format(entry['type'], entry['url']))
+        if self.job_queue:
+            if not self.job_queue.put(entry, self.getPriority(entry)):
+                debug(2, "Already queued <{}>".format(entry['url']))
+            return
+
+        self.queueDownload(entry)
+
+    def resumeDownloads(self):
+        '''
+           Queue again the downloads of the journaled run which didn't complete
+
+           RETURNS: the number of downloads queued
+        '''
+        pending = self.journal.getPending() if DOWNLOAD else []
+        for entry in pending:
+            self.queueDownload(entry)
+        return len(pending)
+
+    def waitForDownloads(self):
+        ''' Wait for the download queue (or the shared job queue) to drain, then stop the workers '''
+        if self.job_queue:
+            for worker in self.download_workers:
+                worker.join()
+            del self.download_workers[:]
+            self.lease_renewer.set()
+            return
+
+        self.download_queue.join()
+        for worker in self.download_workers:
+            self.download_queue.put( (float('inf'), next(self.download_sequence), None) )
+        for worker in self.download_workers:
+            worker.join()
+        del self.download_workers[:]
+
+    def showProgress(self, stop):
+        ''' Print a progress line every PROGRESS_INTERVAL seconds until stop is set '''
+        last_bytes = 0
+        last_time = monotonic()
+        while not stop.wait(PROGRESS_INTERVAL):
+            now = monotonic()
+            nbytes = getCounter('bytes_downloaded')
+            gaugeMetric('queue_depth', self.download_queue.qsize())
+            sys.stderr.write("\r[{:.0f}s] files {}/{} ({} skipped, {} failed)  {}  {}/s  queue {}  retries {}   ".format(
+                now - run_start, getCounter('files_downloaded'), getCounter('files_queued'),
+                getCounter('files_skipped'), len(self.failures), formatBytes(nbytes),
+                formatBytes((nbytes - last_bytes) / (now - last_time)),
+                self.download_queue.qsize(), getCounter('http_retries') + getCounter('download_resumes')))
+            sys.stderr.flush()
+            last_bytes = nbytes
+            last_time = now
+        sys.stderr.write("\n")
+
+    def startProgress(self):
+        ''' RETURNS: the event stopping the progress display thread, if enabled '''
+        stop = threading.Event()
+        if PROGRESS:
+            threading.Thread(target=self.showProgress, args=(stop,), name='progress', daemon=True).start()
+        return stop
+
+## -- Course: -------------------------------------------------------
+
+class CourseDownloader:
+    '''
+       The crawl of one course run through a FutureLearnClient.
+       All of the state of the course lives here, so that several courses can be
+       crawled at once through the same client
+    '''
+    def __init__(self, client, course_id, course_run, quality=None):
+        self.client = client
+        self.course_id = course_id
+        self.course_run = course_run
+        self.quality = quality or client.quality
+        self.course_url = client.base_url + '/courses/{}/{}/todo'.format(course_id, course_run)
+        self.step_url = client.base_url + '/courses/{}/{}/steps'.format(course_id, course_run)
+        self.download_dir = client.op_dir + '/' + course_id
+        self.week_ids = None
+
+    def getCoursePage(self):
+        '''
+           GET the todo page of this course run, and parse it for the weeks
+
+           RETURNS: the list of week ids in order
+           RAISES: RequestFailed if the page couldn't be fetched
+        '''
+        weeks = self.getJournaledPage('course')
+        if weeks is not None:
+            return weeks
+
+        status_code, content = self.client.getPage(self.course_url)
+        if status_code != 200:
+            raise RequestFailed(self.course_url, 'HTTP {}'.format(status_code), False)
+
+        self.client.saveDebugItem( 'course.' + self.course_id + '.response.content', "'course page'", content)
+
+        return self.recordJournaledPage('course', parseCoursePage(content))
+
+    def getJournaledPage(self, page):
+        ''' RETURNS: the parsed content of page recorded in the journal of the client, or None '''
+        if not self.client.journal:
+            return None
+        return self.client.journal.getPage('{}/{}/{}'.format(self.course_id, self.course_run, page))
+
+    def recordJournaledPage(self, page, content):
+        ''' Record the parsed content of page in the journal of the client. RETURNS: content '''
+        if self.client.journal:
+            self.client.journal.recordPage('{}/{}/{}'.format(self.course_id, self.course_run, page), content)
+        return content
+
+    def iter_weeks(self, week_num=-1):
+        '''
+           Generate the weeks of the course (or only the week week_num), fetching the
+           course page on first use
+
+           RETURNS: generator of (week_num, week_id)
+           RAISES: RequestFailed if the course page couldn't be fetched, ValueError if there's no such week
+        '''
+        if self.week_ids is None:
+            self.week_ids = self.getCoursePage()
+
+        if week_num == -1: # All
+            for week_num, week_id in enumerate(self.week_ids, 1):
+                yield week_num, week_id
+            return
+
+        if week_num > len(self.week_ids) or week_num < 1:
+            raise ValueError("No such week as {} in course '{}'".format(week_num, self.course_id))
+        yield week_num, self.week_ids[week_num-1]
+
+    def getCourseWeekPage(self, week_id):
+        '''
+           GET a week page of the course, failures are recorded on the client
+
+           RETURNS: the list of step ids of the week
+        '''
+        url = self.course_url + '/{}'.format(week_id)
+
+        steps = self.getJournaledPage('week/' + week_id)
+        if steps is not None:
+            return steps
+
+        try:
+            status_code, content = self.client.getPage(url)
+        except RequestFailed as exc:
+            self.client.recordFailure(exc.url, exc.reason, exc.retryable, 'week {}'.format(week_id))
+            return []
+
+        if status_code != 200:
+            self.client.recordFailure(url, 'HTTP {}'.format(status_code), False, 'week {}'.format(week_id))
+            return []
+
+        self.client.saveDebugItem( 'course.' + self.course_id + '.w' + week_id + '.response.content',
+                                   "'course week {} page'".format(week_id),
+                                   content)
+
+        return self.recordJournaledPage('week/' + week_id, parseCourseWeekPage(content))
+
+    def iter_steps(self, weeks=None):
+        '''
+           Generate the steps of the given (week_num, week_id) weeks, default all weeks
+
+           RETURNS: generator of (week_num, week_id, step_id)
+        '''
+        if weeks is None:
+            weeks = list(self.iter_weeks())
+
+        for week_num, week_id in weeks:
+            steps = self.getCourseWeekPage(week_id)
+            debug(2, "Week{} STEPS={}".format(week_num, str(steps)))
+            for step_id in steps:
+                yield week_num, week_id, step_id
+
+    def getCourseWeekStepPage(self, week_id, step_id, week_num):
+        '''
+            get the specified step page
+
+            RETURNS: dict of downloadable urls by type, dict of subtitle tracks (see getDownloadableURLs)
+        '''
+        client = self.client
+        url = self.step_url + '/' + str(step_id)
+
+        URLS = {}
+        tracks = {}
+
+        journaled = self.getJournaledPage('step/' + step_id)
+        if journaled is not None:
+            URLS, tracks = journaled
+            return URLS, { url: tuple(track) for url, track in tracks.items() }
+
+        try:
+            status_code, content = client.getPage(url)
+        except RequestFailed as exc:
+            client.recordFailure(exc.url, exc.reason, exc.retryable, 'step {} of week {}'.format(step_id, week_num))
+            return URLS, tracks
+
+        if status_code != 200:
+            client.recordFailure(url, 'HTTP {}'.format(status_code), False, 'step {} of week {}'.format(step_id, week_num))
+            #fatal("getCourseWeekStepPage: Failed to download url <{}>".format(url))
+            return URLS, tracks
+
+        ofile = client.saveItem( 'course.' + self.course_id + '.s' + step_id + '.response.content',
+                                 "'course week step {} page'".format(step_id),
+                                 content)
+
+        if client.archive:
+            title, text = getStepText(content)
+            client.archive.addStep(self.course_id, self.course_run, week_num, step_id, title, text)
+
+        debug(4, "Searching for {} files in {}".format(str(client.download_types), ofile))
+        URLS = getDownloadableURLs(content, client.download_types, tracks, client.languages, client.url_scheme)
+        num_urls = sum([ len(URLS[DOWNLOAD_TYPE]) for DOWNLOAD_TYPE in URLS ])
+
+        if num_urls > 0 and DEBUG and VERBOSE > 2:
+            print()
+            showDownloads(str(step_id), URLS)
+
+        self.recordJournaledPage('step/' + step_id, [ URLS, tracks ])
+        return URLS, tracks
+
+    def iter_assets(self, weeks=None):
+        '''
+            Generate the manifest of the given (week_num, week_id) weeks, default all weeks.
+            The week pages, then the step pages, are fetched concurrently using the
+            crawl_workers threads of the client, while entries are generated in course order
+
+            RETURNS: generator of manifest entries, one per file to download
+        '''
+        if weeks is None:
+            weeks = list(self.iter_weeks())
+
+        with ThreadPoolExecutor(max_workers=self.client.crawl_workers) as pool:
+            week_steps = list(pool.map(lambda week: self.getCourseWeekPage(week[1]), weeks))
+
+            step_pages = {}
+            for (week_num, week_id), steps in zip(weeks, week_steps):
+                debug(2, "Week{} STEPS={}".format(week_num, str(steps)))
+                for step_id in steps:
+                    step_pages[(week_num, step_id)] = pool.submit(self.getCourseWeekStepPage, week_id, step_id, week_num)
+
+            # Filenames are numbered in page order, so generate the manifest in that order:
+            # Subtitles come last, to be named after the video they caption
+            for (week_num, week_id), steps in zip(weeks, week_steps):
+                file_num = 0
+                for step_id in steps:
+                    URLS, tracks = step_pages[(week_num, step_id)].result()
+                    videos = {}
+                    for DOWNLOAD_TYPE in sorted(self.client.download_types, key=lambda DOWNLOAD_TYPE: 'track' in getAssetType(DOWNLOAD_TYPE).sources):
+                        for url in URLS.get(DOWNLOAD_TYPE, []):
+                            if getAssetType(DOWNLOAD_TYPE).numbered:
+                                file_num += 1
+                            entry = self.getManifestEntry(week_num, step_id, url, DOWNLOAD_TYPE, file_num,
+                                                          tracks.get(url), videos)
+                            if DOWNLOAD_TYPE == 'mp4':
+                                videos[url] = entry['file']
+                            yield entry
+
+    def getManifestEntry(self, week_num, step_id, url, DOWNLOAD_TYPE, file_num, track=None, videos={}):
+        '''
+            Choose the target filename of a downloadable url, numbered file_num within its week,
+            by the filename policy of its asset type.
+            track is the (video url, language) of subtitles and videos the video url -> file of the step
+
+            RETURNS: the manifest entry describing the download
+        '''
+        asset_type = getAssetType(DOWNLOAD_TYPE)
+        entry = { 'course_id': self.course_id, 'course_run': self.course_run,
+                  'week_num': week_num, 'step_id': step_id, 'type': DOWNLOAD_TYPE, 'url': url }
+
+        if 'video' in asset_type.sources:
+            self.setVideoQuality(entry)
+        if 'track' in asset_type.sources:
+            entry['video'], entry['lang'] = track or (None, self.client.languages[0])
+
+        entry['file'] = asset_type.filename(self, entry, file_num, videos)
+        return entry
+
+    def setVideoQuality(self, entry):
+        ''' Let the quality policy choose the rendition of the video of entry at download time '''
+        entry['quality'] = self.quality
+        if entry['url'].endswith('/download/hd'):
+            entry['sd_url'] = entry['url'][:-len('/hd')]
+
+    def getAssetEntry(self, asset):
+        ''' RETURNS: the manifest entry downloading again an asset recorded in the database '''
+        entry = { name: asset[name] for name in ('course_id', 'course_run', 'week_num', 'step_id', 'type', 'url', 'file') }
+        if 'video' in getAssetType(entry['type']).sources:
+            self.setVideoQuality(entry)
+        return entry
+
+    def syncManifest(self, manifest, week_nums):
+        '''
+            Compare a freshly crawled manifest of the weeks week_nums with the assets recorded
+            in the database: files of known assets which were renamed (e.g. because steps were
+            reordered) are moved to their new name, assets no longer in the course are reported.
+            Known assets recorded with an ETag are revalidated with the server, those replaced
+            under the same url being marked 'changed' so that their file is downloaded again
+
+            RETURNS: the manifest entries which are new, or whose file is missing or changed
+        '''
+        known = self.client.getKnownAssets(self.course_id, self.course_run)
+        known = { url: row for url, row in known.items() if row['week_num'] in week_nums }
+        todo = []
+        revalidate = []
+        num_moved = 0
+
+        for entry in manifest:
+            row = known.pop(entry['url'], None)
+            if row is None:
+                todo.append(entry)
+                continue
+
+            if row['file'] != entry['file'] and os.path.exists(row['file']) and not os.path.exists(entry['file']):
+                debug(1, "Renaming <{}> to <{}>".format(row['file'], entry['file']))
+                mkdir_p(os.path.dirname(entry['file']))
+                os.replace(row['file'], entry['file'])
+                self.client.recordAsset(entry, { 'size': row['size'], 'etag': None, 'sha256': None })
+                num_moved += 1
+
+            if not os.path.exists(entry['file']) or os.path.getsize(entry['file']) != row['size']:
+                todo.append(entry)
+            elif row['etag'] and not getAssetType(entry['type']).fetch:
+                revalidate.append( (entry, row['etag']) )
+
+        with ThreadPoolExecutor(max_workers=self.client.crawl_workers) as pool:
+            changed = list(pool.map(lambda item: self.client.isChangedAsset(*item), revalidate))
+        countMetric('assets_revalidated', len(revalidate))
+        for (entry, etag), is_changed in zip(revalidate, changed):
+            if is_changed:
+                debug(1, "Changed on the server: <{}>".format(entry['url']))
+                entry['changed'] = True
+                todo.append(entry)
+
+        for url in known:
+            print("Deleted from course: {} <{}>".format(known[url]['file'], url))
+
+        debug(1, "Sync: {} new or changed, {} renamed, {} unchanged, {} deleted".format(
+              len(todo), num_moved, len(manifest) - len(todo), len(known)))
+
+        return todo
+
+    def selectWeeks(self, week_num=-1):
+        '''
+            RETURNS: the (week_num, week_id) of all weeks of the course run, or of its week week_num,
+                     or None if the course couldn't be crawled
+        '''
+        try:
+            weeks = list(self.iter_weeks(week_num))
+        except RequestFailed as exc:
+            self.client.recordFailure(exc.url, exc.reason, exc.retryable, 'course {} run {}'.format(self.course_id, self.course_run))
+            return None
+        except ValueError as exc:
+            print("ERROR: " + str(exc))
+            return None
+
+        debug(1, "Downloading {}-week course '{}' run {}".format(len(self.week_ids), self.course_id, self.course_run))
+        if week_num != -1:
+            debug(1, "Downloading week " + str(week_num))
+        return weeks
+
+    def download(self, week_num=-1, sync=False):
+        '''
+            Crawl the course run (or only its week week_num), and queue its files
+            on the download workers of the client
+
+            RETURNS: False if the course couldn't be crawled
+        '''
+        weeks = self.selectWeeks(week_num)
+        if weeks is None:
+            return False
+
+        with timed('crawl'):
+            manifest = list(self.iter_assets(weeks))
+        debug(1, "Found {} files to download in {} week(s)".format(len(manifest), len(weeks)))
+
+        if sync:
+            manifest = self.syncManifest(manifest, [ week[0] for week in weeks ])
+
+        for entry in manifest:
+            self.client.downloadFile(entry)
+
+        return True
+
+    def plan(self, week_num=-1):
+        '''
+            Crawl the course run (or only its week week_num) without downloading anything:
+            the size of each file not present yet is found with a HEAD request, these being
+            sent concurrently by the crawl_workers threads of the client
+
+            RETURNS: list of (manifest entry, size or None if unknown) of the files to download,
+                     or None if the course couldn't be crawled
+        '''
+        weeks = self.selectWeeks(week_num)
+        if weeks is None:
+            return None
+
+        def getSize(entry):
+            if os.path.exists(entry['file']) and os.path.getsize(entry['file']) != 0:
+                return 0
+            if getAssetType(entry['type']).fetch:
+                return None
+            try:
+                return self.client.getContentLength(self.client.getVideoRenditions(entry)[0])
+            except RequestFailed as exc:
+                self.client.recordFailure(exc.url, exc.reason, exc.retryable, entry['file'])
+                return None
+
+        with timed('crawl'):
+            manifest = list(self.iter_assets(weeks))
+        with ThreadPoolExecutor(max_workers=self.client.crawl_workers) as pool:
+            sizes = list(pool.map(getSize, manifest))
+
+        return [ (entry, size) for entry, size in zip(manifest, sizes) if size != 0 ]
+
+## -- Plan: ---------------------------------------------------------
+
+def showPlan(label, plan):
+    ''' Print the number of files and bytes to download per week and type of a plan '''
+    print("-- {}: files to download -----------".format(label))
+    print("{:>4}  {:<5} {:>6} {:>10} {:>8}".format('week', 'type', 'files', 'bytes', 'unknown'))
+
+    rows = {}
+    for entry, size in plan:
+        row = rows.setdefault( (entry['week_num'], entry['type']), [ 0, 0, 0 ] )
+        row[0] += 1
+        row[1] += size or 0
+        row[2] += size is None
+
+    for (week_num, type), (num_files, nbytes, unknown) in sorted(rows.items()):
+        print("{:>4}  {:<5} {:>6} {:>10} {:>8}".format(week_num, type, num_files, formatBytes(nbytes), unknown))
+
+def estimateDuration(plan, bytes_per_second, workers=1, max_rate=0, windows=None, host_rate=HOST_RATE, host_burst=HOST_BURST):
+    '''
+       Estimate how long downloading a plan takes: at least the time to transfer its bytes
+       at bytes_per_second per worker (if known) with workers downloading at once, capped
+       at max_rate bytes/sec (if not 0), and the time the per-host rate limit (host_rate
+       requests/second after a burst of host_burst) takes to allow a request for each file.
+       With time windows, this time is spread over the share of the week they are open,
+       from the start of the next one
+
+       RETURNS: the estimated seconds
+    '''
+    hosts = {}
+    for entry, size in plan:
+        host = urlparse(entry['url']).netloc
+        hosts[host] = hosts.get(host, 0) + 1
+
+    seconds = max([ max(0, num_files - host_burst) / host_rate for num_files in hosts.values() ] + [ 0 ])
+    throughput = 0
+    if bytes_per_second:
+        # No more workers are busy than there are files:
+        throughput = bytes_per_second * max(1, min(workers, len(plan)))
+    if max_rate:
+        throughput = min(throughput, max_rate) if throughput else max_rate
+    if throughput:
+        seconds = max(seconds, sum([ size or 0 for entry, size in plan ]) / throughput)
+
+    if windows:
+        seconds = getWindowWait(windows) + seconds / getWindowsShare(windows)
+    return seconds
+
+def getPreviousThroughput(metrics_file):
+    ''' RETURNS: the bytes/sec per download worker of the last run which downloaded into metrics_file's OP_DIR, or None '''
+    if not os.path.exists(metrics_file):
+        return None
+    with open(metrics_file, 'r') as f:
+        throughput = json.load(f).get('throughput')
+    if not throughput:
+        return None
+    return throughput['bytes_per_second'] / throughput['download_workers']
+
+
+## -- Verify: -------------------------------------------------------
+
+def verifyFile(asset):
+    '''
+       Check the file of an asset recorded in the database (run by the processes of verifyAssets)
+
+       RETURNS: None if the file is intact, else what is wrong with it
+    '''
+    file = asset['file']
+    if not os.path.exists(file):
+        return 'missing'
+    size = os.path.getsize(file)
+    if asset['size'] is not None and size != asset['size']:
+        return 'size {} instead of {}'.format(size, asset['size'])
+    if not isCompleteFile(file, asset['type']):
+        return 'not a {} file'.format(asset['type'])
+    if asset['sha256'] and hashFile(file) != asset['sha256']:
+        return 'sha256 mismatch'
+    return None
+
+def verifyAssets(assets, processes=VERIFY_PROCESSES):
+    '''
+       Check the files of the assets recorded in the database with a pool of processes
+
+       RETURNS: the list of (asset, problem) of the broken files
+    '''
+    broken = []
+    with timed('verify'):
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            for asset, problem in zip(assets, pool.map(verifyFile, assets, chunksize=8)):
+                countMetric('files_verified')
+                if problem:
+                    print("BROKEN: {} - {}".format(asset['file'], problem))
+                    broken.append( (asset, problem) )
+    countMetric('files_broken', len(broken))
+    return broken
+
+def repairAssets(client, broken):
+    '''
+       Queue the download of the broken assets again, removing their files (and their blob,
+       when the file is a link to it: the blob is broken too)
+    '''
+    for asset, problem in broken:
+        file = asset['file']
+        if client.store and asset['sha256'] and os.path.exists(file):
+            blob = client.store.getBlobFile(asset['sha256'])
+            if os.path.exists(blob) and os.path.samefile(file, blob):
+                client.store.forget(asset['sha256'])
+        if os.path.exists(file):
+            os.remove(file)
+        client.downloadFile(client.course(asset['course_id'], asset['course_run']).getAssetEntry(asset))
+
+## -- Main: --------------------------------------------------------
+
+def loginOrReport(client, email, password, check_url):
+    '''
+       Log the client in, reporting a failure and closing the client
+
+       RETURNS: True if logged in
+    '''
+    try:
+        client.login(email, password, check_url=check_url)
+        return True
+    except RequestFailed as exc:
+        print("ERROR: login failed: {}".format(exc))
+        client.close()
+        return False
+
+def planCourses(client, courses, bytes_per_second, tmp_dir):
+    '''
+       Report what downloading the (course_id, course_run, week_num) courses would take
+
+       RETURNS: the exit status
+    '''
+    full_plan = []
+    num_failed_courses = 0
+    for course_id, course_run, week_num in courses:
+        plan = client.course(course_id, course_run).plan(week_num)
+        if plan is None:
+            num_failed_courses += 1
+            continue
+        showPlan("course '{}' run {}".format(course_id, course_run), plan)
+        full_plan += plan
+
+    nbytes = sum([ size or 0 for entry, size in full_plan ])
+    unknown = len([ size for entry, size in full_plan if size is None ])
+    print("-- Total: {} files, {} ({} of unknown size) -----------".format(len(full_plan), formatBytes(nbytes), unknown))
+    max_rate = client.bandwidth.rate if client.bandwidth else 0
+    print("Estimated duration: {:.0f}s with {} workers, {} requests/sec per host{}{}{}".format(
+          estimateDuration(full_plan, bytes_per_second, client.workers, max_rate, client.windows, client.host_rate, client.host_burst),
+          client.workers, client.host_rate,
+          ', at {}/s per worker'.format(formatBytes(bytes_per_second)) if bytes_per_second else ' (throughput unknown until a first download)',
+          ', capped at {}/s'.format(formatBytes(max_rate)) if max_rate else '',
+          ', in time windows open {:.0%} of the week'.format(getWindowsShare(client.windows)) if client.windows else ''))
+
+    client.evictCache()
+    if client.cookie_file:
+        client.saveCookies()
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+
+    num_failures = len(client.failures)
+    client.close()
+    if num_failures or num_failed_courses:
+        return 1
+    return 0
+
+
+def verifyDownloads(client, email, password, tmp_dir):
+    '''
+       Check the files recorded in the database, downloading the broken ones again if the
+       email and password are given
+
+       RETURNS: the exit status
+    '''
+    assets = client.getAllAssets()
+    broken = verifyAssets(assets)
+    print("-- Verified {} files: {} broken -----------".format(len(assets), len(broken)))
+
+    num_failures = 0
+    if broken and password:
+        asset = broken[0][0]
+        if not loginOrReport(client, email, password, client.course(asset['course_id'], asset['course_run']).course_url):
+            return 1
+        client.startDownloadWorkers()
+        repairAssets(client, broken)
+        client.waitForDownloads()
+        for course_id in set([ asset['course_id'] for asset, problem in broken ]):
+            client.writeChecksumManifest(course_id)
+        if client.cookie_file:
+            client.saveCookies()
+        num_failures = client.writeFailureReport(client.op_dir + '/.futurelearn-dl.failures.json')
+
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    client.close()
+    if num_failures or ( broken and not password ):
+        return 1
+    return 0
+
+def searchSteps(op_dir, query, limit=SEARCH_LIMIT):
+    '''
+       Print the archived steps matching the full-text query, with the files of their assets
+
+       RETURNS: the exit status
+    '''
+    archive_file = op_dir + '/.futurelearn-dl.archive.db'
+    if not os.path.exists(archive_file):
+        print("No step archive in <{}>".format(op_dir))
+        return 1
+
+    client = FutureLearnClient(op_dir=op_dir)
+    client.openManifestDB(op_dir + '/.futurelearn-dl.db')
+    try:
+        client.openArchive(archive_file)
+    except sqlite3.OperationalError as exc:
+        print("ERROR: can't search the step archive <{}>: {}".format(archive_file, exc))
+        client.close()
+        return 1
+
+    start = monotonic()
+    try:
+        steps = client.archive.search(query, limit)
+    except sqlite3.OperationalError:
+        # Not a valid FTS5 query: search it as a phrase
+        steps = client.archive.search('"' + query.replace('"', '""') + '"', limit)
+    elapsed = monotonic() - start
+
+    for step in steps:
+        print("{} run {} week {} step {}: {}".format(step['course_id'], step['course_run'], step['week_num'],
+                                                     step['step_id'], step['title']))
+        print("    " + getSnippet(step['text'], query))
+        for file in client.getStepFiles(step['course_id'], step['course_run'], step['step_id']):
+            print("    " + file)
+    print("-- {} step(s) found in {:.1f}ms -----------".format(len(steps), elapsed * 1000))
+
+    client.close()
+    return 0
+
+def runQueueWorker(email, password, queue_file, tmp_dir, op_dir, cache_dir, cookie_dir, store_dir, max_rate, windows,
+                   host_rate, host_burst):
+    '''
+       Download the jobs of the shared job queue queue_file until it is finished, as a worker
+       process (--worker) of the courses crawled by a coordinator
+
+       RETURNS: the exit status
+    '''
+    worker_name = getWorkerName().replace(':', '-')
+    worker_tmp_dir = tmp_dir + '/FUTURELEARN_DL.' + worker_name
+    mkdir_p(worker_tmp_dir)
+    mkdir_p(op_dir)
+
+    client = FutureLearnClient(op_dir=op_dir, cache_dir=cache_dir, cookie_dir=cookie_dir, tmp_dir=worker_tmp_dir,
+                               max_rate=max_rate, windows=windows, host_rate=host_rate, host_burst=host_burst)
+    client.openManifestDB(op_dir + '/.futurelearn-dl.db')
+    if STORE:
+        client.openStore(store_dir)
+    client.openJobQueue(queue_file)
+
+    # The login is checked against a course of the coordinator, once it has logged in:
+    while client.job_queue.getMeta('check_url') is None:
+        sleep(JOB_POLL)
+    if not loginOrReport(client, email, password, client.job_queue.getMeta('check_url')):
+        return 1
+
+    client.startDownloadWorkers()
+    stop_progress = client.startProgress()
+    with timed('downloads_drain'):
+        client.waitForDownloads()
+    stop_progress.set()
+
+    if os.path.exists(worker_tmp_dir):
+        shutil.rmtree(worker_tmp_dir)
+
+    timeMetric('run', monotonic() - run_start)
+    writeMetrics(op_dir + '/.futurelearn-dl.metrics.' + worker_name + '.json', os.getenv('FL_METRICS_PROM'))
+
+    num_failures = client.writeFailureReport(op_dir + '/.futurelearn-dl.failures.' + worker_name + '.json')
+    client.close()
+    return 1 if num_failures else 0
+
+def runLocalWorker(argv):
+    ''' Process target of the local workers of --processes '''
+    global PROGRESS
+    PROGRESS = False
+    sys.exit(main(argv))
+
+def main(argv=None):
+    TMP_DIR = os.getenv('TMP_DIR', default='/tmp')
+    FD_TMP_DIR = TMP_DIR + '/FUTURELEARN_DL'
+    OP_DIR  = os.getenv('OP_DIR',  default='.')
+    CACHE_DIR = os.getenv('FL_CACHE_DIR', default=os.path.expanduser('~/.cache/futurelearn-dl/pages'))
+    COOKIE_DIR = os.getenv('FL_COOKIE_DIR', default=os.path.expanduser('~/.cache/futurelearn-dl'))
+    STORE_DIR = os.getenv('FL_STORE_DIR', default=OP_DIR + '/.futurelearn-dl.store')
+
+    debug(2, "Using temp   dir <{}>".format(FD_TMP_DIR))
+    debug(2, "Using Output dir <{}>".format(OP_DIR))
+
+    parser = argparse.ArgumentParser(description='Download videos and other materials of futurelearn.com courses')
+    parser.add_argument('email', nargs='?')
+    parser.add_argument('password', nargs='?')
+    parser.add_argument('course_id', nargs='?')
+    parser.add_argument('course_run', type=int, nargs='?')
+    parser.add_argument('week_num', type=int, nargs='?', default=-1,
+                        help='only download this week (default: all weeks)')
+    parser.add_argument('--sync', action='store_true',
+                        help='only download assets which are new or changed since the last run')
+    parser.add_argument('--course', action='append', metavar='ID:RUN',
+                        help='also download this course run, may be repeated')
+    parser.add_argument('--batch', metavar='FILE',
+                        help="also download the courses listed in FILE, one '<course_id> <course_run> [<week_num>]' per line")
+    parser.add_argument('--resume', action='store_true',
+                        help='resume the interrupted run journaled in OP_DIR, with its courses and options')
+    parser.add_argument('--queue', metavar='FILE',
+                        help='share the downloads with other worker processes through the job queue FILE, on a filesystem shared by their hosts')
+    parser.add_argument('--worker', action='store_true',
+                        help='only download the jobs of the --queue, until the coordinator crawling the courses has finished')
+    parser.add_argument('--processes', type=int, default=1, metavar='N',
+                        help='with --queue, run N worker processes on this host (default: 1)')
+    parser.add_argument('--schedule', choices=SCHEDULES, default=SCHEDULE,
+                        help='download order: page order, by type (FL_TYPE_PRIORITY, default {}), smallest first or week by week (default: {})'.format(
+                             ','.join(TYPE_PRIORITY), SCHEDULE))
+    parser.add_argument('--max-rate', metavar='BYTES', default=MAX_RATE,
+                        help='cap of the download throughput in bytes/sec, e.g. 2M (default: none)')
+    parser.add_argument('--host-rate', metavar='N', type=float, default=HOST_RATE,
+                        help='requests/sec allowed to each host, by all of the --processes (default: {})'.format(HOST_RATE))
+    parser.add_argument('--host-burst', metavar='N', type=int, default=HOST_BURST,
+                        help='burst of requests allowed to each host, by all of the --processes (default: {})'.format(HOST_BURST))
+    parser.add_argument('--windows', metavar='LIST', default=WINDOWS,
+                        help="local time windows downloads are allowed in, e.g. '19:00-07:00,sat-sun 00:00-24:00' (default: always)")
+    parser.add_argument('--verify', action='store_true',
+                        help='check the size, type and sha256 of the files recorded in OP_DIR, and download the broken ones again (given email and password)')
+    parser.add_argument('--plan', action='store_true',
+                        help='only report the files, bytes and estimated time of the download, writing nothing')
+    parser.add_argument('--quality', choices=QUALITY_MODES, default=QUALITY,
+                        help='video quality policy (default: {})'.format(QUALITY))
+    parser.add_argument('--quality-for', action='append', metavar='ID=MODE', default=[],
+                        help='video quality policy of the course ID, may be repeated')
+    parser.add_argument('--types', metavar='LIST', default=','.join(DOWNLOAD_TYPES),
+                        help='comma separated download types (default: {}), see --list-types'.format(','.join(DOWNLOAD_TYPES)))
+    parser.add_argument('--list-types', action='store_true',
+                        help='list the registered download types, then exit')
+    parser.add_argument('--search', metavar='QUERY',
+                        help='search the text of the steps archived in OP_DIR (words, "phrases", AND/OR/NOT, prefix*), then exit')
+    parser.add_argument('--convert-vtt', metavar='DIR',
+                        help='convert the vtt files below DIR to srt, then exit')
+    args = parser.parse_args(argv)
+
+    if args.list_types:
+        for name in sorted(ASSET_TYPES):
+            print("{:<8} {}".format(name, ASSET_TYPES[name].description))
+        return 0
+
+    if args.convert_vtt:
+        debug(1, "Converted {} vtt files".format(convertVTTDirectory(args.convert_vtt)))
+        return 0
+
+    if args.search:
+        return searchSteps(OP_DIR, args.search)
+
+    if ( args.worker or args.processes > 1 ) and not args.queue:
+        parser.error('--worker and --processes require a --queue')
+    if args.queue and ( args.resume or args.plan ):
+        parser.error('--resume and --plan cannot be used with --queue: a queued run resumes by running it again')
+    if args.plan and args.resume:
+        parser.error('--resume cannot be used with --plan: plan the courses of the run instead')
+    if not args.verify and ( args.password is None or ( args.course_run is None and not args.course and not args.batch and not args.resume and not args.worker ) ):
+        parser.error('email, password and a course_id and course_run (or --course/--batch/--resume) are required')
+
+    try:
+        parseWindows(args.windows)
+        # The caps are shared by the local worker processes:
+        max_rate = str(parseBytes(args.max_rate) // max(1, args.processes))
+    except ValueError as exc:
+        parser.error('--max-rate/--windows: {}'.format(exc))
+    if args.host_rate <= 0 or args.host_burst < 1:
+        parser.error('--host-rate must be above 0 and --host-burst at least 1')
+    host_rate = args.host_rate / max(1, args.processes)
+    host_burst = max(1, args.host_burst // max(1, args.processes))
+
+    if args.worker and args.verify:
+        parser.error('--verify cannot be used with --worker')
+    if args.worker:
+        return runQueueWorker(args.email, args.password, args.queue, TMP_DIR, OP_DIR, CACHE_DIR, COOKIE_DIR, STORE_DIR,
+                              max_rate, args.windows, host_rate, host_burst)
+
+    email = args.email
+    password = args.password
+
+    courses = []
+    if args.course_id:
+        courses.append( (args.course_id, args.course_run, args.week_num) )
+    for course in args.course or []:
+        course_id, _, course_run = course.partition(':')
+        if not course_id or not course_run.isdigit():
+            parser.error('--course expects <course_id>:<course_run>, not <{}>'.format(course))
+        courses.append( (course_id, int(course_run), -1) )
+    if args.batch:
+        try:
+            courses += readCourseList(args.batch)
+        except ValueError as exc:
+            parser.error('--batch: {}'.format(exc))
+    if not courses and not args.resume and not args.verify:
+        parser.error('a course_id and course_run (or --course/--batch) are required')
+
+    course_quality = {}
+    for quality_for in args.quality_for:
+        course_id, _, quality = quality_for.partition('=')
+        if not quality in QUALITY_MODES:
+            parser.error("--quality-for: expected ID=MODE with MODE one of {}".format(', '.join(QUALITY_MODES)))
+        course_quality[course_id] = quality
+
+    client = FutureLearnClient(op_dir=OP_DIR, cache_dir=CACHE_DIR, cookie_dir=COOKIE_DIR, tmp_dir=FD_TMP_DIR,
+                               quality=args.quality, course_quality=course_quality,
+                               schedule=args.schedule, max_rate=max_rate, windows=args.windows,
+                               host_rate=host_rate, host_burst=host_burst,
+                               download_types=[ type.strip() for type in args.types.split(',') if type.strip() ])
+
+    if os.path.exists(FD_TMP_DIR):
+        shutil.rmtree(FD_TMP_DIR)
+    mkdir_p(FD_TMP_DIR)
+    if not os.path.isdir(FD_TMP_DIR):
+        fatal("Failed to create tmp dir <{}>".format(FD_TMP_DIR))
+    if client.cache_dir:
+        mkdir_p(client.cache_dir)
+    if not args.plan:
+        mkdir_p(OP_DIR)
+        client.openManifestDB(OP_DIR + '/.futurelearn-dl.db')
+        if STORE:
+            client.openStore(STORE_DIR)
+        if args.verify:
+            return verifyDownloads(client, email, password, FD_TMP_DIR)
+        if ARCHIVE:
+            try:
+                client.openArchive(OP_DIR + '/.futurelearn-dl.archive.db')
+            except sqlite3.OperationalError as exc:
+                print("WARNING: not archiving the step pages: {}".format(exc))
+
+        # The journaled run, if resumed, brings its own courses and options:
+        run = None
+        if args.queue:
+            client.openJobQueue(args.queue)
+        else:
+            run = client.openJournal(OP_DIR + '/.futurelearn-dl.journal', args.resume)
+        if run:
+            courses = [ tuple(course) for course in run['courses'] ]
+            args.sync = run['sync']
+            client.download_types = run['download_types']
+        elif not courses:
+            parser.error('no interrupted run to resume, a course_id and course_run (or --course/--batch) are required')
+        elif client.journal:
+            client.journal.write('run', courses=courses, sync=args.sync, download_types=client.download_types)
+
+    debug(2, "Using e-mail={} password=***** courses={}".format(email, str(courses)))
+
+    ## -- do the login, unless the cookies of a previous run are still valid:
+    if not loginOrReport(client, email, password, client.course(courses[0][0], courses[0][1]).course_url):
+        return 1
+
+    if args.plan:
+        return planCourses(client, courses, getPreviousThroughput(OP_DIR + '/.futurelearn-dl.metrics.json'), FD_TMP_DIR)
+
+    # The other workers of the queue wait for the login to reuse its cookies:
+    worker_processes = []
+    if client.job_queue:
+        client.job_queue.startCrawl(client.course(courses[0][0], courses[0][1]).course_url)
+        for i in range(args.processes - 1):
+            process = multiprocessing.Process(target=runLocalWorker, name='worker-{}'.format(i),
+                                              args=([ '--worker', '--queue', args.queue, '--max-rate', max_rate, '--windows', args.windows,
+                                                      '--host-rate', str(host_rate), '--host-burst', str(host_burst), email, password ],))
+            process.start()
+            worker_processes.append(process)
+
+    # All courses share the session and the download workers:
+    client.startDownloadWorkers()
+    stop_progress = client.startProgress()
+
+    if run:
+        debug(1, "Resuming {} pending downloads".format(client.resumeDownloads()))
+
+    num_failed_courses = 0
+    for course_id, course_run, week_num in courses:
+        if not client.course(course_id, course_run).download(week_num, args.sync):
+            num_failed_courses += 1
+    if client.job_queue:
+        client.job_queue.finishCrawl()
+
+    with timed('downloads_drain'):
+        client.waitForDownloads()
+    stop_progress.set()
+    for course_id in set([ course_id for course_id, course_run, week_num in courses ]):
+        client.writeChecksumManifest(course_id)
+    client.evictCache()
+    if client.cookie_file:
+        client.saveCookies()
+
+    if os.path.exists(FD_TMP_DIR):
+        shutil.rmtree(FD_TMP_DIR)
+
+    timeMetric('run', monotonic() - run_start)
+    writeMetrics(OP_DIR + '/.futurelearn-dl.metrics.json', os.getenv('FL_METRICS_PROM'))
+
+    num_failures = client.writeFailureReport(OP_DIR + '/.futurelearn-dl.failures.json')
+    for process in worker_processes:
+        process.join()
+        if process.exitcode != 0:
+            num_failures += 1
+    if client.job_queue:
+        debug(1, "Job queue <{}>: {}".format(args.queue, client.job_queue.getCounts()))
+    if client.journal:
+        # Failed downloads stay pending in the journal, for --resume to queue them again:
+        finished = not num_failures and not num_failed_courses
+        client.journal.close(finished=finished)
+        if not finished:
+            print("Run journaled in <{}>: --resume retries what didn't complete".format(client.journal.file))
+    client.close()
+    if num_failures or num_failed_courses:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+################################################################################
+
+# REQUEST methods:
+#dir(request)=['__class__', '__delattr__', '__dict__', '__dir__', '__doc__', '__eq__', '__format__', '__ge__', '__getattribute__', '__gt__', '__hash__', '__init__', '__le__', '__lt__', '__module__', '__ne__', '__new__', '__reduce__', '__reduce_ex__', '__repr__', '__setattr__', '__sizeof__', '__str__', '__subclasshook__', '__weakref__', '_cookies', '_encode_files', '_encode_params', 'body', 'copy', 'deregister_hook', 'headers', 'hooks', 'method', 'path_url', 'prepare', 'prepare_auth', 'prepare_body', 'prepare_content_length', 'prepare_cookies', 'prepare_headers', 'prepare_hooks', 'prepare_method', 'prepare_url', 'register_hook', 'url']
+
+# RESPONSE methods:
+#['__attrs__', '__bool__', '__class__', '__delattr__', '__dict__', '__dir__', '__doc__', '__eq__', '__format__', '__ge__', '__getattribute__', '__getstate__', '__gt__', '__hash__', '__init__', '__iter__', '__le__', '__lt__', '__module__', '__ne__', '__new__', '__nonzero__', '__reduce__', '__reduce_ex__', '__repr__', '__setattr__', '__setstate__', '__sizeof__', '__str__', '__subclasshook__', '__weakref__', '_content', '_content_consumed', 'apparent_encoding', 'close', 'connection', 'content', 'cookies', 'elapsed', 'encoding', 'headers', 'history', 'is_permanent_redirect', 'is_redirect', 'iter_content', 'iter_lines', 'json', 'links', 'ok', 'raise_for_status', 'raw', 'reason', 'request', 'status_code', 'text', 'url']
+
+
+
@@ -0,0 +1,113 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import futurelearn_dl as fl
+
+def getEntry(num):
+    return { 'course_id': 'course', 'course_run': 1, 'url': 'http://example.com/{}.pdf'.format(num) }
+
+class Clock:
+    ''' Stand-in for time.time(), only moving when told to '''
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.clock = Clock()
+        patcher = mock.patch.object(fl, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = fl.JobQueue(self.dir.name + '/jobs.db', lease_time=60)
+        self.queue.startCrawl('http://example.com/courses/course/1')
+
+    def tearDown(self):
+        self.queue.close()
+        self.dir.cleanup()
+
+    def test_put_queues_an_entry_once(self):
+        self.assertTrue(self.queue.put(getEntry(1)))
+        self.assertFalse(self.queue.put(getEntry(1)))
+        self.assertEqual(self.queue.getCounts(), { 'pending': 1 })
+
+    def test_lease_by_priority(self):
+        self.queue.put(getEntry(1), priority=2)
+        self.queue.put(getEntry(2), priority=1)
+        self.assertEqual(self.queue.lease('a'), getEntry(2))
+        self.assertEqual(self.queue.lease('b'), getEntry(1))
+        self.assertIsNone(self.queue.lease('c'))
+
+    def test_expired_lease_is_leased_again(self):
+        self.queue.put(getEntry(1))
+        self.assertEqual(self.queue.lease('host:1:0'), getEntry(1))
+        self.clock.now += 59
+        self.assertIsNone(self.queue.lease('host:2:0'))
+        self.clock.now += 2
+        self.assertEqual(self.queue.lease('host:2:0'), getEntry(1))
+
+        # The first owner no longer holds the job, so can't complete it:
+        self.queue.complete(getEntry(1), 'host:1:0')
+        self.assertEqual(self.queue.getCounts(), { 'leased': 1 })
+        self.queue.complete(getEntry(1), 'host:2:0')
+        self.assertEqual(self.queue.getCounts(), { 'done': 1 })
+
+    def test_renew_extends_the_leases_of_a_process(self):
+        self.queue.put(getEntry(1))
+        self.queue.put(getEntry(2))
+        self.queue.lease('host:1:0')
+        self.queue.lease('host:2:0')
+        self.clock.now += 50
+        self.queue.renew('host:1:')
+        self.clock.now += 20
+        # Only the lease of the process which didn't renew has expired:
+        self.assertEqual(self.queue.lease('host:3:0'), getEntry(2))
+        self.assertIsNone(self.queue.lease('host:3:1'))
+
+    def test_retryable_failure_is_retried_until_out_of_attempts(self):
+        self.queue.put(getEntry(1))
+        failure = { 'retryable': True }
+        for attempt in range(fl.JOB_ATTEMPTS - 1):
+            self.assertEqual(self.queue.lease('a'), getEntry(1))
+            self.queue.complete(getEntry(1), 'a', failure)
+            self.assertEqual(self.queue.getCounts(), { 'pending': 1 })
+        self.queue.lease('a')
+        self.queue.complete(getEntry(1), 'a', failure)
+        self.assertEqual(self.queue.getCounts(), { 'failed': 1 })
+
+    def test_permanent_failure_is_not_retried(self):
+        self.queue.put(getEntry(1))
+        self.queue.lease('a')
+        self.queue.complete(getEntry(1), 'a', { 'retryable': False })
+        self.assertEqual(self.queue.getCounts(), { 'failed': 1 })
+        self.assertIsNone(self.queue.lease('a'))
+
+    def test_finished_once_crawled_and_drained(self):
+        self.queue.put(getEntry(1))
+        self.assertFalse(self.queue.isFinished())
+        self.queue.finishCrawl()
+        self.assertFalse(self.queue.isFinished())
+        self.queue.lease('a')
+        self.assertFalse(self.queue.isFinished())
+        self.queue.complete(getEntry(1), 'a')
+        self.assertTrue(self.queue.isFinished())
+
+    def test_restarted_crawl_keeps_unfinished_jobs(self):
+        self.queue.put(getEntry(1))
+        self.queue.put(getEntry(2))
+        self.queue.lease('a')
+        self.queue.complete(getEntry(1), 'a')
+        self.queue.finishCrawl()
+        self.queue.startCrawl('http://example.com/courses/course/1')
+        self.assertFalse(self.queue.isFinished())
+        self.assertEqual(self.queue.getCounts(), { 'pending': 1 })
+        self.assertTrue(self.queue.put(getEntry(1)))
+
+if __name__ == '__main__':
+    unittest.main()
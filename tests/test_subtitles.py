@@ -0,0 +1,63 @@
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import futurelearn_dl as fl
+
+VTT = (b'WEBVTT\r\n\r\n'
+       b'00:00:01.000 --> 00:00:02.500\r\nHello\r\nworld\r\n\r\n'
+       b'00:00:03.000 --> 00:00:04.000\r\nSecond cue\r\n')
+
+class ChunkedRaw(io.BytesIO):
+    ''' Response body returned chunk_size bytes at a time, whatever is asked for '''
+    def __init__(self, content, chunk_size):
+        io.BytesIO.__init__(self, content)
+        self.chunk_size = chunk_size
+
+    def read(self, size=-1):
+        return io.BytesIO.read(self, self.chunk_size)
+
+def getResponse(content, chunk_size):
+    response = requests.models.Response()
+    response.status_code = 200
+    response.raw = ChunkedRaw(content, chunk_size)
+    return response
+
+class DownloadConvertedTest(unittest.TestCase):
+    def test_crlf_vtt_split_across_chunks(self):
+        client = fl.FutureLearnClient()
+        with tempfile.TemporaryDirectory() as dir:
+            # Every chunk size puts some CRLF across a chunk boundary:
+            for chunk_size in range(1, 9):
+                client.httpRequest = lambda method, url, **kwargs: getResponse(VTT, chunk_size)
+                srtfile = '{}/{}.srt'.format(dir, chunk_size)
+                client.downloadConverted('http://example.com/captions.vtt', srtfile, fl.convertVTTLines)
+                with open(srtfile, 'r') as f:
+                    self.assertEqual(f.read(), '1\n00:00:01,000 --> 00:00:02,500\nHello\nworld\n\n'
+                                               '2\n00:00:03,000 --> 00:00:04,000\nSecond cue\n')
+        client.close()
+
+    def test_vtt_bytes_are_counted(self):
+        client = fl.FutureLearnClient()
+        client.httpRequest = lambda method, url, **kwargs: getResponse(VTT, 7)
+        before = fl.getCounter('bytes_downloaded')
+        with tempfile.TemporaryDirectory() as dir:
+            client.downloadConverted('http://example.com/captions.vtt', dir + '/captions.srt', fl.convertVTTLines)
+        self.assertEqual(fl.getCounter('bytes_downloaded') - before, len(VTT))
+        client.close()
+
+class IterTextLinesTest(unittest.TestCase):
+    def test_lines_split_across_chunks(self):
+        text = 'caf\u00e9\r\nline\rcr only\n\nlast'
+        data = text.encode('utf8')
+        for chunk_size in range(1, 6):
+            chunks = [ data[i:i + chunk_size] for i in range(0, len(data), chunk_size) ]
+            self.assertEqual(list(fl.iterTextLines(chunks)), text.splitlines())
+
+if __name__ == '__main__':
+    unittest.main()